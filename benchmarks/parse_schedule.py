@@ -0,0 +1,59 @@
+"""Rows parsed per second from a team's schedule page.
+
+Compares parsing the games and the links to the opponents the way the
+scraper used to, with `scrape.parse_schedule` and `scrape.get_additional_links`
+each building a BeautifulSoup tree, with the single pass of
+`scrape.parse_schedule_page`, and checks both give the same output.
+
+    $ python benchmarks/parse_schedule.py
+    $ python benchmarks/parse_schedule.py --repeat 50 path/to/schedule.html
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nbaelo import scrape
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests',
+    'cle_2016_schedule.html')
+
+
+def parse_with_soup(raw_html):
+    return scrape.parse_schedule(raw_html), scrape.get_additional_links(raw_html)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default=FIXTURE)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    # dateutil warns about the EST of every row
+    warnings.simplefilter('ignore')
+    logging.disable(logging.INFO)
+    with open(args.path) as f:
+        raw_html = f.read()
+
+    soup_games, soup_links = parse_with_soup(raw_html)
+    games, links = scrape.parse_schedule_page(raw_html)
+    assert games == soup_games, 'Parsers disagree on the games'
+    assert sorted(links) == sorted(soup_links), 'Parsers disagree on the links'
+
+    print("%s, %s rows" % (os.path.basename(args.path), len(games)))
+    for name, parse in (('soup', parse_with_soup), ('lxml', scrape.parse_schedule_page)):
+        start = time.time()
+        for _ in range(args.repeat):
+            parse(raw_html)
+        elapsed = time.time() - start
+        print("%-5s %10.0f rows/sec %8.2f ms/page" % (name, args.repeat * len(games) / elapsed,
+            1000 * elapsed / args.repeat))
+
+
+if __name__ == '__main__':
+    main()
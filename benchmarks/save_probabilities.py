@@ -0,0 +1,78 @@
+"""Per-date cost of writing simulated probabilities.
+
+Compares writing every team of every date one row at a time, the way
+probabilities used to be saved (a team lookup, a delete and a commit, then
+an add and a commit per team), with `tasks.save_probabilities`.
+
+    $ python benchmarks/save_probabilities.py
+    $ python benchmarks/save_probabilities.py --database-url postgresql://localhost/nbaelo_bench
+
+The tables of the given database are dropped and recreated, only point it at
+a scratch database.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, Config
+from nbaelo import create_app, db, models, tasks
+
+
+def generate_results(dates, symbols):
+    first_date = datetime.date(2016, 10, 25)
+    return {first_date + datetime.timedelta(days=i): {symbol: dict(playoff=random.random(),
+        top_seed=random.random(), champion=random.random(), trials=1000, standard_error=.01) for symbol in symbols}
+        for i in range(dates)}
+
+
+def save_row_by_row(season_id, results):
+    for date, data in results.items():
+        for team, probabilities in data.items():
+            team_id = models.Team.query.filter_by(symbol=team).first().id
+            models.SimulatedProbabilities.query.filter_by(season_id=season_id, team_id=team_id, date=date).delete()
+            db.session.commit()
+            db.session.add(models.SimulatedProbabilities(season_id=season_id, team_id=team_id, date=date,
+                **probabilities))
+            db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=None, help="defaults to a temporary sqlite file")
+    parser.add_argument('--dates', type=int, default=50)
+    args = parser.parse_args()
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+        SQLALCHEMY_TRACK_MODIFICATIONS = False
+    config['benchmark'] = BenchmarkConfig()
+
+    app = create_app('benchmark')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        symbols = ['T%02d' % i for i in range(Config.NUMBER_NBA_TEAMS)]
+        db.session.add_all([models.Team(team_name=symbol, symbol=symbol) for symbol in symbols])
+        season = models.Season(year=2017)
+        db.session.add(season)
+        db.session.commit()
+
+        print("%s, %s dates of %s teams" % (db.engine.dialect.name, args.dates, len(symbols)))
+        for name, save in (('row by row', save_row_by_row), ('bulk', tasks.save_probabilities)):
+            # the second run replaces the rows written by the first
+            for run in ('insert', 'replace'):
+                results = generate_results(args.dates, symbols)
+                start = time.time()
+                save(season.id, results)
+                elapsed = time.time() - start
+                print("%-10s %-7s %8.2f ms/date" % (name, run, 1000 * elapsed / args.dates))
+
+
+if __name__ == '__main__':
+    main()
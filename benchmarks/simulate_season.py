@@ -0,0 +1,110 @@
+"""Seasons simulated per second from a mid-season snapshot.
+
+Builds a 30 team league of 86 games a team, plays through the first
+`--played` share of the schedule and times `Simulator.simulate_many_seasons`
+along with each stage of a batch: drawing the outcomes, the records, ranking
+the conferences and the accumulators.
+
+    $ python benchmarks/simulate_season.py
+    $ python benchmarks/simulate_season.py --trials 100000 --workers 4
+"""
+import argparse
+import copy
+import datetime
+import itertools
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nbaelo import elo
+
+
+EAST = ['BOS', 'BRK', 'NYK', 'PHI', 'TOR', 'CHI', 'CLE', 'DET', 'IND', 'MIL', 'ATL', 'CHO', 'MIA', 'ORL', 'WAS']
+WEST = ['DEN', 'MIN', 'OKC', 'POR', 'UTA', 'GSW', 'LAC', 'LAL', 'PHO', 'SAC', 'DAL', 'HOU', 'MEM', 'NOP', 'SAS']
+
+
+def make_league(played):
+    """-> (teams, games) where teams meet twice, four times within their
+    conference, and the first `played` share of the games is complete"""
+    random.seed(0)
+    start_date = datetime.datetime(2016, 10, 25)
+    teams = [elo.Team(symbol, start_date, elo.EASTERN_CONFERENCE) for symbol in EAST] + \
+        [elo.Team(symbol, start_date, elo.WESTERN_CONFERENCE) for symbol in WEST]
+    strength = {team.symbol: random.gauss(0, 5) for team in teams}
+
+    matchups = list(itertools.permutations(EAST + WEST, 2))
+    matchups.extend(itertools.permutations(EAST, 2))
+    matchups.extend(itertools.permutations(WEST, 2))
+    random.shuffle(matchups)
+    games = []
+    for i, (home, away) in enumerate(matchups):
+        date = start_date + datetime.timedelta(days=i * 165 // len(matchups))
+        if i < played * len(matchups):
+            home_points = int(100 + strength[home] + random.gauss(3, 12))
+            away_points = int(100 + strength[away] + random.gauss(0, 12))
+            if home_points == away_points:
+                home_points += 1
+            games.append(elo.Game(home, away, date, home_points, away_points))
+        else:
+            games.append(elo.Game(home, away, date))
+    return teams, games
+
+
+def time_stages(simulator, trials):
+    """-> {stage: seconds} of one batch of `trials` seasons"""
+    rng = np.random.default_rng(0)
+    accumulators = copy.deepcopy(simulator.accumulators)
+    for accumulator in accumulators:
+        accumulator.start(simulator)
+    timings = {}
+
+    start = time.time()
+    home_won = simulator.simulate_outcomes(trials, rng)
+    timings['outcomes'] = time.time() - start
+    start = time.time()
+    win_totals, tiebreak_wins = simulator.get_records(home_won)
+    timings['records'] = time.time() - start
+    start = time.time()
+    seedings = simulator.rank_conferences(home_won, win_totals, tiebreak_wins, rng)
+    timings['ranking'] = time.time() - start
+    start = time.time()
+    batch = elo.SimulatedBatch(win_totals, seedings)
+    for accumulator in accumulators:
+        accumulator.add(batch)
+    timings['accumulators'] = time.time() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--trials', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--played', type=float, default=.3, help="share of the schedule already played")
+    args = parser.parse_args()
+
+    teams, games = make_league(args.played)
+    simulator = elo.Simulator(2017, teams, games, workers=args.workers, seed=1)
+    start = time.time()
+    simulator.prepare_arrays()
+    print("%s remaining games, snapshot prepared in %.3f s" % (len(simulator.home), time.time() - start))
+
+    # the first batch pays for warming up, time the second
+    time_stages(simulator, simulator.batch_size)
+    timings = time_stages(simulator, simulator.batch_size)
+    for stage, elapsed in timings.items():
+        print("%-12s %8.1f ms per %s trials" % (stage, 1000 * elapsed, simulator.batch_size))
+
+    start = time.time()
+    simulator.simulate_many_seasons(args.trials)
+    elapsed = time.time() - start
+    print("%s trials on %s workers in %.2f s (%.0f trials/sec)" % (args.trials, args.workers, elapsed,
+        args.trials / elapsed))
+
+
+if __name__ == '__main__':
+    main()
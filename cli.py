@@ -4,15 +4,21 @@
 # nbaelo delete 2015
 
 # nbaelo createdb
+import calendar
+import collections
 import logging
 from datetime import datetime, date, timedelta
 
 import click
+from flask import current_app
 from sqlalchemy import func
 
 import nbaelo
 
 from nbaelo import models, db, tasks, utils
+from nbaelo.backfill import backfill_probabilities
+from nbaelo.httpcache import HTTPCache
+from nbaelo.ingest import ingest_archive
 from nbaelo.scrape import GameScraper
 
 
@@ -31,10 +37,6 @@ def date_range(dt1, dt2):
         yield dt
 
 
-def exists_date(dt):
-    return bool(models.SimulatedProbabilities.query.filter_by(date=dt).first())
-
-
 @click.group()
 @click.option('--verbose', is_flag=True, help="Increase logging output")
 def cli(verbose):
@@ -57,28 +59,109 @@ def createdb(drop):
 
 
 @cli.command()
-@click.argument('year', type=int)
-@click.option('--sleep', '-s', type=int, default=1)
-def scrape(year, sleep):
-    _scrape(year, sleep)
+def upgradedb():
+    """Adds the tables, columns and indexes of this version to an existing database"""
+    statements = models.upgrade_schema()
+    logger.info("Database upgraded with %s statements", len(statements))
+
 
+@cli.command()
+@click.argument('year', type=int)
+@click.option('--sleep', '-s', type=int, default=1, help="Seconds between requests to the site once a burst is used up.")
+@click.option('--workers', '-w', type=int, default=4, help="Number of schedules fetched at once.")
+@click.option('--burst', type=int, default=1, help="Number of requests allowed back to back.")
+@click.option('--refresh', is_flag=True, default=False, help="Fetch and ingest every schedule, changed or not.")
+@click.option('--league', is_flag=True, default=False,
+    help="Read the league's monthly schedules instead of every team's schedule.")
+@click.option('--pending', is_flag=True, default=False,
+    help="Only fetch the schedules of games that should be over but have no score yet.")
+def scrape(year, sleep, workers, burst, refresh, league, pending):
+    _scrape(year, sleep, workers, burst, refresh, league, pending)
+
+
+def _scrape(year, sleep=1, workers=4, burst=1, refresh=False, league=False, pending=False):
+    directory = current_app.config.get('HTTP_CACHE_DIR')
+    scraper = GameScraper(sleep, workers=workers, burst=burst, cache=HTTPCache(directory) if directory else None,
+        refresh=refresh)
+
+    # a season not ingested yet, or a refresh, is scraped in full
+    pending_games = tasks.get_pending_games(year) if pending and not refresh else None
+    if pending_games == []:
+        logger.info("No game of season %s is waiting on a result", year)
+        return models.ScheduleChanges([], [])
+
+    if league:
+        months = None
+        if pending_games is not None:
+            months = list(collections.OrderedDict((calendar.month_name[dt.month].lower(), None)
+                for dt, _, _ in pending_games))
+        games = scraper.scrape_league(year, months)
+    else:
+        teams = None
+        if pending_games is not None:
+            teams = sorted({home for _, home, _ in pending_games} | {away for _, _, away in pending_games})
+        games = scraper.scrape(year, teams=teams)
+    if not games:
+        logger.info("No schedule of season %s changed since the last scrape", year)
+        return models.ScheduleChanges([], [])
+
+    if league:
+        changes = models.Game.insert_league_schedule(year, games)
+    else:
+        changes = nbaelo.models.Game.insert_schedule_of_games(year, games)
+    tasks.write_season_cache(year)
+    tasks.update_elo_history(year, since=changes.earliest_date)
+    if scraper.cache is not None:
+        scraper.save_cache()
+    return changes
 
-def _scrape(year, sleep=1):
-    scraper = GameScraper(sleep)
-    games = scraper.scrape(year)
 
-    nbaelo.models.Game.insert_schedule_of_games(year, games)
+@cli.command()
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--processes', '-p', type=int, default=None, help="Number of processes parsing pages, one per core by default.")
+def ingest(path, processes):
+    """Ingests the team schedules saved in a directory or tarball (e.g.
+    teams/CLE/2016_games.html) instead of scraping them"""
+    changes = ingest_archive(path, processes)
+    for year, season_changes in sorted(changes.items()):
+        tasks.write_season_cache(year)
+        tasks.update_elo_history(year, since=season_changes.earliest_date)
 
 
 @cli.command()
 @click.argument('year', type=int)
 @click.option('--force', '-f', is_flag=True, default=False)
 @click.option('--trials', '-t', type=int, default=1000)
-def generate_probabilities(year, force, trials):
-    _generate_probabilities(year, force, trials)
-
-
-def _generate_probabilities(year, force=False, trials=None):
+@click.option('--workers', '-w', type=int, default=1, help="Number of processes to spread the trials across.")
+@click.option('--seed', type=int, default=None, help="Seed for reproducible simulations.")
+@click.option('--tolerance', type=float, default=None,
+    help="Keep simulating --trials seasons at a time until every probability has at most this standard error.")
+@click.option('--max-trials', type=int, default=100000, help="Most seasons to simulate per date with --tolerance.")
+def generate_probabilities(year, force, trials, workers, seed, tolerance, max_trials):
+    _generate_probabilities(year, force, trials, workers, seed, tolerance, max_trials)
+
+
+def _generate_probabilities(year, force=False, trials=None, workers=1, seed=None, tolerance=None, max_trials=100000,
+        since=None):
+    dates = _get_dates_to_generate(year, force, since)
+    logger.info("Generating team probabilities for %s dates of season %s", len(dates), year)
+    if dates:
+        tasks.generate_season_probabilities(year, dates, trials, workers, seed, tolerance, max_trials)
+
+
+def _get_dates_to_generate(year, force=False, since=None):
+    """Dates of the season through today whose probabilities are not
+    complete. With `force` every date, or with `since` every date from then
+    on, is first reset so an interrupted run picks up where it stopped."""
+    season_id, dates = _get_season_dates(year)
+    if force or since is not None:
+        tasks.reset_jobs(season_id, [dt for dt in dates if force or dt >= since])
+    completed = tasks.get_completed_dates(season_id)
+    return [dt for dt in dates if dt not in completed]
+
+
+def _get_season_dates(year):
+    """-> (season_id, every date of the season through today)"""
     season_id = models.Season.query.filter_by(year=year).first().id
     first_day_of_season = db.session.query(func.min(models.Game.date)).filter(models.Game.season == season_id).scalar().date()
     last_day_of_season = db.session.query(func.max(models.Game.date)).filter(models.Game.season == season_id).scalar().date()
@@ -88,15 +171,78 @@ def _generate_probabilities(year, force=False, trials=None):
     # for up to today
     last_day = min(utils.now_pst().date(), last_day_of_season)
 
-    for dt in date_range(first_day_of_season, last_day):
-        if force:
-            logger.info("Generating team probabilities as of %s" % dt)
-            tasks.generate_daily_probabilities(dt, trials)
-        else:
-            if not exists_date(dt):
-                logger.info("Generating team probabilities as of %s" % dt)
-                tasks.generate_daily_probabilities(dt, trials)
-            logger.info("Probabilities for %s already exists. Skipping", dt)
+    return season_id, list(date_range(first_day_of_season, last_day))
+
+
+@cli.command()
+@click.argument('years', type=int, nargs=-1, required=True)
+def status(years):
+    """Shows how far the probabilities of each season have been generated"""
+    for year in years:
+        season_id, dates = _get_season_dates(year)
+        job_status = tasks.get_job_status(season_id, dates)
+        click.echo("%s: %s/%s dates complete (%.0f%%), %s trials in %.0fs of simulating, %.2f dates/sec, eta %s" % (
+            year, job_status.complete, job_status.total, 100. * job_status.complete / max(job_status.total, 1),
+            job_status.trials, job_status.duration, job_status.rate, job_status.eta or 'unknown'))
+
+
+@cli.command()
+@click.argument('years', type=int, nargs=-1, required=True)
+@click.option('--force', '-f', is_flag=True, default=False)
+@click.option('--trials', '-t', type=int, default=1000)
+@click.option('--processes', '-p', type=int, default=None, help="Number of processes to spread the dates across, one per core by default.")
+@click.option('--seed', type=int, default=None, help="Seed for reproducible simulations.")
+@click.option('--tolerance', type=float, default=None,
+    help="Keep simulating --trials seasons at a time until every probability has at most this standard error.")
+@click.option('--max-trials', type=int, default=100000, help="Most seasons to simulate per date with --tolerance.")
+@click.option('--max-pending', type=int, default=None, help="Most dates simulated ahead of the database writer.")
+def backfill(years, force, trials, processes, seed, tolerance, max_trials, max_pending):
+    """Generates the probabilities of several seasons, a date per process"""
+    season_dates = {year: _get_dates_to_generate(year, force) for year in years}
+    backfill_probabilities(season_dates, trials, seed, tolerance, max_trials, processes, max_pending)
+
+
+@cli.command()
+@click.argument('years', type=int, nargs=-1, required=True)
+def cache_seasons(years):
+    """Rewrites the season cache of the given seasons from the database"""
+    for year in years:
+        tasks.write_season_cache(year)
+
+
+@cli.command()
+@click.argument('year', type=int)
+@click.option('--since', default=None, help="Rebuild the history from this date (YYYY-MM-DD) on.")
+def elo_history(year, since):
+    since = datetime.strptime(since, '%Y-%m-%d').date() if since else None
+    tasks.update_elo_history(year, since)
+
+
+@cli.command()
+@click.option('--chunk-size', type=int, default=10000, help="Games read and written at a time.")
+def rate_all_seasons(chunk_size):
+    """Rebuilds the elo history of every season, carrying ratings over by ELO_CARRYOVER"""
+    tasks.rate_all_seasons(chunk_size)
+
+
+@cli.command()
+@click.option('--year', '-y', type=int, multiple=True, help="Season to replay, every season if left out.")
+@click.option('--k-factor', type=float, multiple=True)
+@click.option('--mov-offset', type=float, multiple=True)
+@click.option('--mov-exponent', type=float, multiple=True)
+@click.option('--denom-base', type=float, multiple=True)
+@click.option('--denom-slope', type=float, multiple=True)
+@click.option('--carryover', type=float, multiple=True)
+@click.option('--top', type=int, default=10, help="Number of best settings to show.")
+def calibrate(year, top, **grid):
+    """Replays the games under every combination of the given values (each
+    option can be repeated) and ranks them by log-loss of the pre-game win
+    probabilities."""
+    grid = {field: values for field, values in grid.items() if values}
+    sweep = tasks.calibrate(grid, year or None)
+    click.echo("%-80s %8s %8s" % ('parameters', 'log-loss', 'brier'))
+    for parameters, log_loss, brier_score in sweep.scores()[:top]:
+        click.echo("%-80s %8.5f %8.5f" % (parameters, log_loss, brier_score))
 
 
 @cli.command()
@@ -110,12 +256,20 @@ def bootstrap():
 
 
 @cli.command()
-@click.option('--sleep', '-s', type=int, default=10)
+@click.option('--sleep', '-s', type=int, default=10, help="Seconds between requests to the site once a burst is used up.")
+@click.option('--workers', '-w', type=int, default=4, help="Number of schedules fetched at once.")
+@click.option('--burst', type=int, default=1, help="Number of requests allowed back to back.")
+@click.option('--refresh', is_flag=True, default=False, help="Fetch and ingest every schedule, changed or not.")
+@click.option('--league', is_flag=True, default=False,
+    help="Read the league's monthly schedules instead of every team's schedule.")
 @click.option('--trials', '-t', type=int, default=1000)
-def update(sleep, trials):
+def update(sleep, workers, burst, refresh, league, trials):
     season_year = tasks.get_season_year_from_date(date.today())
-    _scrape(season_year, sleep=sleep)
-    _generate_probabilities(season_year, force=False, trials=trials)
+    # nightly, only the schedules of the games played since the last run
+    changes = _scrape(season_year, sleep=sleep, workers=workers, burst=burst, refresh=refresh, league=league,
+        pending=True)
+    # only the dates after a new or corrected result need simulating again
+    _generate_probabilities(season_year, force=False, trials=trials, since=changes.stale_probabilities_since)
 
 
 if __name__ == '__main__':
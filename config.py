@@ -8,6 +8,13 @@ class Config:
     DEBUG = True
     SECRET_KEY = os.environ.get('SECRET_KEY', 'hard*to!guess_string')
     NUMBER_NBA_TEAMS = 30
+    # share of its distance from 1500 a team keeps into the next season when
+    # rating every season in one pass, 0 restarts every team at 1500
+    ELO_CARRYOVER = 0.
+    # columnar copies of each season's games, rewritten after every ingest
+    SEASON_CACHE_DIR = os.path.join(basedir, 'season_cache')
+    # last fetched copy of each scraped page, to only ingest the pages that changed
+    HTTP_CACHE_DIR = os.path.join(basedir, 'http_cache')
 
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'nba_games.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = True
@@ -27,7 +34,15 @@ class HerokuConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
 
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SEASON_CACHE_DIR = None
+    HTTP_CACHE_DIR = None
+
+
 config = dict(
     development=Config(),
-    heroku=HerokuConfig()
+    heroku=HerokuConfig(),
+    testing=TestingConfig()
 )
\ No newline at end of file
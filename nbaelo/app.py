@@ -1,4 +1,4 @@
-from datetime import timedelta, date, datetime
+from datetime import date, datetime
 from flask import Blueprint, render_template, abort, jsonify, request, redirect, url_for
 
 import sqlalchemy
@@ -29,14 +29,22 @@ def get_team_or_404(team_symbol):
 
 @utils.memoized
 def get_played_through_season(year):
-    season = get_season_or_404(year)
-    games = models.Game.query.filter_by(season=season.id).all()
-    day_before_first_day_of_season = min(g.date for g in games) - timedelta(1)
-    gs = elo.Game.from_list_of_games(games)
-    teams = elo.Team.generate_teams_from_season_of_games(gs, day_before_first_day_of_season)
-
+    get_season_or_404(year)
+    season_id, gs, teams = tasks.load_season(year)
     season = elo.Season(year, teams, gs)
-    season.play_through_season()
+
+    # ratings come straight from the stored history, only replay the season
+    # if it has not been rated yet
+    history = db.session.query(models.EloHistory.date, models.EloHistory.rating_change,
+            models.EloHistory.won, models.Team.symbol)\
+        .join(models.Team, models.Team.id == models.EloHistory.team_id)\
+        .filter(models.EloHistory.season_id == season_id)\
+        .order_by(models.EloHistory.date, models.EloHistory.id).all()
+    if not history:
+        season.play_through_season()
+    # teams already start from the ratings carried over from the season before
+    for dt, rating_change, won, symbol in history:
+        season.teams[symbol].update_rating(dt, rating_change, won)
     return season
 
 @utils.memoized
@@ -63,8 +71,10 @@ def get_upcoming_games(date):
 
 @utils.memoized
 def get_date_probabilities(date):
-    probs = models.SimulatedProbabilities.query.filter(models.SimulatedProbabilities.date == date)
-    return {p.team.symbol: p for p in probs}
+    probs = db.session.query(models.Team.symbol, models.SimulatedProbabilities)\
+        .join(models.SimulatedProbabilities.team)\
+        .filter(models.SimulatedProbabilities.date == date)
+    return {symbol: p for symbol, p in probs}
 
 
 def get_latest_date_available():
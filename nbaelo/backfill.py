@@ -0,0 +1,110 @@
+import collections
+import datetime
+import logging
+import multiprocessing
+import time
+
+from . import elo, tasks
+
+
+logger = logging.getLogger(__name__)
+
+
+class Progress:
+
+    """Logs how many of `total` items are done, the throughput and an
+    estimate of the time left, at most every `interval` seconds. The total
+    can be None when it is not known up front."""
+
+    def __init__(self, total, name='dates', interval=10):
+        self.total = total
+        self.name = name
+        self.interval = interval
+        self.done = 0
+        self.started = self.last_logged = time.time()
+
+    def update(self, count=1):
+        self.done += count
+        now = time.time()
+        if now - self.last_logged >= self.interval or self.done == self.total:
+            self.last_logged = now
+            logger.info(str(self))
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.
+
+    @property
+    def eta(self):
+        if not self.rate or self.total is None:
+            return None
+        return datetime.timedelta(seconds=round((self.total - self.done) / self.rate))
+
+    def __str__(self):
+        return "%s/%s %s (%.2f %s/sec, eta %s)" % (self.done, '?' if self.total is None else self.total, self.name,
+            self.rate, self.name, self.eta)
+
+
+def _simulate_date(task):
+    season_id, date, snapshot, kwargs = task
+    started = time.time()
+    data = tasks.simulate_probabilities(snapshot, **kwargs)
+    return season_id, date, data, time.time() - started
+
+
+def backfill_probabilities(season_dates, trials=1000, seed=None, tolerance=None, max_trials=100000,
+        processes=None, max_pending=None, write_batch=50):
+    """Generates the probabilities of many dates across a pool of processes.
+
+    `season_dates` maps each season year to the dates to generate. Every
+    season is loaded and replayed once, here, and each date is handed to the
+    pool as a snapshot. The pool only simulates: this process is the single
+    writer, saving results `write_batch` dates at a time. No more than
+    `max_pending` dates (by default four per process) are handed to the pool
+    ahead of the writer, so a slow database holds back the workers instead of
+    filling up memory. Dates are seeded the same way as in
+    `tasks.generate_season_probabilities` so either gives the same results.
+    Every write marks its dates complete, so an interrupted backfill only
+    loses the dates not yet written.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    max_pending = max_pending or 4 * processes
+    progress = Progress(sum(len(dates) for dates in season_dates.values()))
+    kwargs = dict(trials=trials, tolerance=tolerance, max_trials=max_trials)
+
+    # workers never touch the database, results come back to be written here
+    with multiprocessing.Pool(processes) as pool:
+        pending = collections.deque()
+        unwritten = collections.defaultdict(dict)
+        durations = {}
+
+        def write(season_id):
+            tasks.save_probabilities(season_id, unwritten.pop(season_id), durations)
+
+        def collect(result):
+            season_id, date, data, duration = result.get()
+            unwritten[season_id][date] = data
+            durations[date] = duration
+            if len(unwritten[season_id]) >= write_batch:
+                write(season_id)
+            progress.update()
+
+        for season_year, dates in sorted(season_dates.items()):
+            if not dates:
+                continue
+            season_id, gs, teams = tasks.load_season(season_year)
+            logger.info("Scheduling %s dates of season %s across %s processes", len(dates), season_year, processes)
+            for date, snapshot in elo.iter_daily_snapshots(season_year, teams, gs, dates):
+                date_seed = None if seed is None else [seed, date.toordinal()]
+                pending.append(pool.apply_async(_simulate_date,
+                    ((season_id, date, snapshot, dict(kwargs, seed=date_seed)),)))
+                while len(pending) >= max_pending:
+                    collect(pending.popleft())
+
+        while pending:
+            collect(pending.popleft())
+        for season_id in list(unwritten):
+            write(season_id)
+
+    logger.info("Backfill complete: %s", progress)
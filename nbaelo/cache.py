@@ -0,0 +1,121 @@
+"""On-disk columnar copies of each season's games.
+
+A season is written as a single .npy file of fixed width records (game id,
+date, home and away team index, points) named after the hash of its
+contents, next to a small JSON file holding that hash, the season id, the
+team symbols the indices refer to and the version of the season in the
+database it was written from, for readers to check it is still current. Loading a season maps the .npy file
+instead of querying the database. The JSON file is replaced atomically, so a
+reader that mapped an older version keeps a consistent copy.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from . import elo
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 1
+
+GAME_DTYPE = np.dtype([('game_id', np.int64), ('date', 'datetime64[s]'), ('home', np.int16), ('away', np.int16),
+    ('home_points', np.int16), ('away_points', np.int16)])
+
+# stands in for the points of games not played yet
+NO_POINTS = -1
+
+
+class CachedSeason:
+
+    """The games of a season as columns, mapped from disk"""
+
+    def __init__(self, year, season_id, symbols, games, content_hash, version=None):
+        self.year = year
+        self.season_id = season_id
+        self.symbols = symbols
+        self.games = games
+        self.content_hash = content_hash
+        self.version = version
+
+    def to_games(self):
+        """-> list of elo.Game"""
+        games = self.games
+        dates = games['date'].astype(datetime.datetime)
+        home_points = [None if points == NO_POINTS else points for points in games['home_points'].tolist()]
+        away_points = [None if points == NO_POINTS else points for points in games['away_points'].tolist()]
+        return [elo.Game(self.symbols[home], self.symbols[away], date, home_pts, away_pts, game_id)
+            for game_id, date, home, away, home_pts, away_pts in zip(games['game_id'].tolist(), dates,
+                games['home'].tolist(), games['away'].tolist(), home_points, away_points)]
+
+    def __len__(self):
+        return len(self.games)
+
+
+def get_metadata_path(directory, year):
+    return os.path.join(directory, 'season-%s.json' % year)
+
+
+def get_data_path(directory, year, content_hash):
+    return os.path.join(directory, 'season-%s-%s.npy' % (year, content_hash))
+
+
+def write_season(directory, year, season_id, games, version=None):
+    """Writes the games of a season, given as (game_id, date, home_symbol,
+    away_symbol, home_points, away_points) tuples, along with the `version`
+    of the season they were read from -> content hash"""
+    games = list(games)
+    symbols = sorted({game[2] for game in games} | {game[3] for game in games})
+    index = {symbol: i for i, symbol in enumerate(symbols)}
+
+    array = np.zeros(len(games), dtype=GAME_DTYPE)
+    for i, (game_id, date, home, away, home_points, away_points) in enumerate(games):
+        # dates are kept as the wall clock time they were stored with
+        array[i] = (game_id, np.datetime64(date.replace(tzinfo=None), 's'), index[home], index[away],
+            NO_POINTS if home_points is None else home_points, NO_POINTS if away_points is None else away_points)
+    array.sort(order=['date', 'game_id'])
+
+    content_hash = hashlib.sha1(array.tobytes() + json.dumps([season_id, symbols]).encode()).hexdigest()[:16]
+    os.makedirs(directory, exist_ok=True)
+    data_path = get_data_path(directory, year, content_hash)
+    if not os.path.exists(data_path):
+        np.save(data_path + '.tmp', array)
+        os.replace(data_path + '.tmp.npy', data_path)
+
+    metadata_path = get_metadata_path(directory, year)
+    with open(metadata_path + '.tmp', 'w') as f:
+        json.dump(dict(version=FORMAT_VERSION, year=year, season_id=season_id, symbols=symbols,
+            content_hash=content_hash, database_version=version), f)
+    os.replace(metadata_path + '.tmp', metadata_path)
+
+    # readers that already mapped an older version keep it until they let go
+    prefix = 'season-%s-' % year
+    for filename in os.listdir(directory):
+        if filename.startswith(prefix) and filename != os.path.basename(data_path):
+            os.remove(os.path.join(directory, filename))
+    logger.info("Cached %s games of season %s as %s", len(array), year, data_path)
+    return content_hash
+
+
+def load_season(directory, year):
+    """-> CachedSeason mapped from the latest version written, None if there
+    is none (or it was written in an older format)"""
+    # a new version can replace the one named in the JSON file before it is
+    # mapped, in which case the JSON file names the new one
+    for attempt in range(2):
+        try:
+            with open(get_metadata_path(directory, year)) as f:
+                metadata = json.load(f)
+            if metadata.get('version') != FORMAT_VERSION:
+                return None
+            games = np.load(get_data_path(directory, year, metadata['content_hash']), mmap_mode='r')
+        except FileNotFoundError:
+            continue
+        return CachedSeason(year, metadata['season_id'], metadata['symbols'], games, metadata['content_hash'],
+            metadata.get('database_version'))
+    return None
@@ -1,8 +1,15 @@
+import array
+import bisect
 import collections
+import copy
 import datetime
 import itertools
+import math
+import multiprocessing
 import random
 
+import numpy as np
+
 from config import Config
 
 
@@ -21,6 +28,94 @@ def get_expected_outcome(rating1, rating2):
     return 1. / x
 
 
+def get_rating_change(home_rating, away_rating, home_points, away_points, k_factor=20, mov_offset=3,
+        mov_exponent=0.8, denom_base=7.5, denom_slope=.0006):
+    """Rating change of the home team after a game: the elo update scaled by
+    the margin of victory, damped when the favourite wins. The away team
+    changes by the negative of it. Ratings and constants can be numpy arrays
+    to rate a game under many settings at once."""
+    margin = home_points - away_points
+
+    numerator = (abs(margin) + mov_offset)**mov_exponent
+
+    denom = denom_base + denom_slope * (home_rating - away_rating)
+
+    expected_outcome = get_expected_outcome(home_rating, away_rating)
+    if home_points > away_points:
+        outcome = (1 - expected_outcome)
+    else:
+        outcome = -expected_outcome
+    return k_factor * (numerator / denom) * outcome
+
+
+def regress_rating(rating, carryover, mean_rating=1500):
+    """Rating a team starts the next season with, keeping `carryover` of its
+    distance from the mean (0 restarts every team at the mean)"""
+    return mean_rating + carryover * (rating - mean_rating)
+
+
+def get_tiebreak_codes(keys):
+    """Packs the tiebreakers of every team into one int64 per team that sorts
+    ascending in seed order, so a conference is ranked with a single argsort
+    instead of a lexsort over every tiebreaker.
+
+    `keys` are (percentages, largest denominator) from most to least
+    important, best first. A percentage w / g with g <= G is stored as
+    floor(p * 2G^2): different fractions are at least 1 / G^2 apart, so they
+    never share a code. -> (codes, number of distinct codes)"""
+    codes = np.zeros(keys[0][0].shape, dtype=np.int64)
+    capacity = 1
+    for percentages, denominator in keys:
+        scale = 2 * int(denominator) ** 2
+        capacity *= scale + 1
+        codes *= scale + 1
+        codes += scale
+        codes -= (percentages * scale).astype(np.int64)
+    return codes, capacity
+
+
+def binomial_coefficient(n, k):
+    return math.factorial(n) // (math.factorial(k) * math.factorial(n - k))
+
+
+def get_series_win_probability(game_win_probability, wins_needed=4):
+    """Probability of winning a best of (2 * wins_needed - 1) series: win the
+    deciding game having won wins_needed - 1 and lost k of the games before it.
+    Works on floats as well as numpy arrays."""
+    p = game_win_probability
+    return sum(binomial_coefficient(wins_needed - 1 + k, k) * p**wins_needed * (1 - p)**k for k in range(wins_needed))
+
+
+# order the seeds so each round pairs neighbouring blocks: 1v8 plays 4v5 and
+# 2v7 plays 3v6
+BRACKET_ORDER = [0, 7, 3, 4, 1, 6, 2, 5]
+
+
+def get_bracket_probabilities(brackets, series_probabilities):
+    """Exact probability of every team winning each round of a knockout bracket.
+
+    brackets is an (n, slots) array of team indices laid out so that round r
+    pairs up neighbouring blocks of 2**r slots, series_probabilities[i, j] is
+    the probability of team i beating team j in a series. Returns an
+    (n, slots, rounds) array.
+    """
+    n, slots = brackets.shape
+    beats = series_probabilities[brackets[:, :, None], brackets[:, None, :]]
+    alive = np.ones((n, slots))
+    positions = np.arange(slots)
+
+    rounds = []
+    size = 1
+    while size < slots:
+        # a slot meets the slots in the other half of its block of 2 * size
+        opponents = (positions[:, None] // (2 * size) == positions[None, :] // (2 * size)) & \
+            (positions[:, None] // size != positions[None, :] // size)
+        alive = alive * np.einsum('uji,ji,ui->uj', beats, opponents, alive)
+        rounds.append(alive)
+        size *= 2
+    return np.stack(rounds, axis=-1)
+
+
 def uncomplete_games(games, after_date):
     for game in games:
         if game.date > after_date:
@@ -103,20 +198,33 @@ def get_point_differentials(games):
     return teams
 
 
+def as_date(dt):
+    return dt.date() if isinstance(dt, datetime.datetime) else dt
+
+
 class Team:
 
     def __init__(self, symbol, start_date, conference, start_rating=1500):
         self.symbol = symbol
         self.start_date = start_date
         self.start_rating = start_rating
-        self.rating_changes = {}
-        self.rating_changes[start_date] = 0
+        # append-only ledger of rating changes in the order the games were
+        # played. cumulative_changes[i] is the sum of changes[:i + 1] so the
+        # current rating and the change over the last n games are O(1)
+        self.dates = [start_date]
+        # day of each entry, start dates are dates and game dates datetimes
+        self.days = [as_date(start_date)]
+        self.changes = array.array('d', [0])
+        self.cumulative_changes = array.array('d', [0])
         self.wins = 0
         self.losses = 0
         self.conference = conference
 
     def update_rating(self, date, rating_change, is_win):
-        self.rating_changes[date] = rating_change
+        self.dates.append(date)
+        self.days.append(as_date(date))
+        self.changes.append(rating_change)
+        self.cumulative_changes.append(self.cumulative_changes[-1] + rating_change)
         if is_win:
             self.wins += 1
         else:
@@ -124,10 +232,20 @@ class Team:
 
     def change_past_games(self, num_games):
         assert num_games > 0
-        reverse_ordered_changes = list(reversed(sorted(self.rating_changes.items(), key=lambda x: x[0])))
+        if num_games >= len(self.cumulative_changes):
+            return self.cumulative_changes[-1]
+        return self.cumulative_changes[-1] - self.cumulative_changes[-1 - num_games]
+
+    def rating_as_of(self, date):
+        """Rating after every game played on or before the day of `date`"""
+        i = bisect.bisect_right(self.days, as_date(date))
+        if i == 0:
+            return self.start_rating
+        return self.start_rating + self.cumulative_changes[i - 1]
 
-        total_games_played = len(reverse_ordered_changes)
-        return sum([reverse_ordered_changes[i][1] for i in range(num_games) if i < total_games_played])
+    @property
+    def rating_changes(self):
+        return collections.OrderedDict(zip(self.dates, self.changes))
 
     @property
     def logo_url(self):
@@ -135,7 +253,7 @@ class Team:
 
     @property
     def current_rating(self):
-        return self.start_rating + sum(self.rating_changes.values())
+        return self.start_rating + self.cumulative_changes[-1]
 
     @property
     def current_record(self):
@@ -143,22 +261,19 @@ class Team:
 
     @property
     def rating_history(self):
-        first_date = min(self.rating_changes.keys())
-        last_date = max(self.rating_changes.keys())
-
-        total_change_each_date = collections.OrderedDict()
-
-        for i in range((last_date - first_date).days + 2):
-            dt = first_date.date() + datetime.timedelta(days=i)
-            total_change_each_date[dt] = 0
-
-        for gamedate, rating_change in self.rating_changes.items():
-            total_change_each_date[gamedate.date()] += rating_change
-
-        cumulative_changes = list(itertools.accumulate(total_change_each_date.values()))
-
-        return [(dt, change + self.start_rating) for dt, change in\
-            zip(total_change_each_date.keys(), cumulative_changes)]
+        """Rating at the end of every day from the start date through the day
+        after the last game"""
+        first_date = self.days[0]
+        last_date = self.days[-1]
+
+        history = []
+        i = 0
+        for day in range((last_date - first_date).days + 2):
+            dt = first_date + datetime.timedelta(days=day)
+            while i < len(self.days) and self.days[i] <= dt:
+                i += 1
+            history.append((dt, self.start_rating + self.cumulative_changes[i - 1]))
+        return history
 
     @classmethod
     def generate_teams_from_season_of_games(cls, games, start_date):
@@ -177,12 +292,14 @@ class Game:
 
     """Wrapper class for models.Game to be used in Season."""
 
-    def __init__(self, home_team, away_team, date, home_points=None, away_points=None):
+    def __init__(self, home_team, away_team, date, home_points=None, away_points=None, game_id=None):
         self.home_team = home_team
         self.away_team = away_team
         self.date = date
         self.home_points = home_points
         self.away_points = away_points
+        # primary key of the models.Game this was copied from, if any
+        self.game_id = game_id
         self.is_simulated = False
 
     def simulate(self, home_elo_rating, away_elo_rating):
@@ -218,7 +335,7 @@ class Game:
         for g in games:
             home_team = g.home_team if isinstance(g.home_team, str) else g.home_team.symbol
             away_team = g.away_team if isinstance(g.away_team, str) else g.away_team.symbol
-            gs.append(cls(home_team, away_team, g.date, g.home_points, g.away_points))
+            gs.append(cls(home_team, away_team, g.date, g.home_points, g.away_points, getattr(g, 'id', None)))
         return gs
 
     def to_dict(self):
@@ -226,41 +343,141 @@ class Game:
                 home_points=self.home_points, away_points=self.away_points, is_simulated=self.is_simulated)
 
 
+DIVISIONS = {
+    'BOS': 'Atlantic', 'BRK': 'Atlantic', 'NJN': 'Atlantic', 'NYK': 'Atlantic', 'PHI': 'Atlantic', 'TOR': 'Atlantic',
+    'CHI': 'Central', 'CLE': 'Central', 'DET': 'Central', 'IND': 'Central', 'MIL': 'Central',
+    'ATL': 'Southeast', 'CHA': 'Southeast', 'CHO': 'Southeast', 'MIA': 'Southeast', 'ORL': 'Southeast', 'WAS': 'Southeast',
+    'DEN': 'Northwest', 'MIN': 'Northwest', 'OKC': 'Northwest', 'POR': 'Northwest', 'SEA': 'Northwest', 'UTA': 'Northwest',
+    'GSW': 'Pacific', 'LAC': 'Pacific', 'LAL': 'Pacific', 'PHO': 'Pacific', 'SAC': 'Pacific',
+    'DAL': 'Southwest', 'HOU': 'Southwest', 'MEM': 'Southwest', 'NOH': 'Southwest', 'NOK': 'Southwest', 'NOP': 'Southwest',
+    'SAS': 'Southwest',
+}
+
+
+def get_percentage(wins, games, default=0):
+    return wins / games if games else default
+
+
+class Standings:
+
+    """Records of every team, kept up to date one result at a time.
+
+    Besides the overall record we count conference and division records and
+    head-to-head wins, which is everything the tiebreakers need. The seeding
+    is cached until the next result comes in. Tied teams are separated by
+    (in order): head-to-head record among the tied teams, division record
+    when they all share a division, conference record and drawing lots.
+    """
+
+    def __init__(self, conferences):
+        # symbol -> conference
+        self.conferences = conferences
+        self.records = {symbol: [0, 0] for symbol in conferences}
+        self.conference_records = {symbol: [0, 0] for symbol in conferences}
+        self.division_records = {symbol: [0, 0] for symbol in conferences}
+        self.head_to_head = collections.Counter()
+        self._seeding = None
+
+    def copy(self):
+        standings = Standings(self.conferences)
+        standings.records = {symbol: list(record) for symbol, record in self.records.items()}
+        standings.conference_records = {symbol: list(record) for symbol, record in self.conference_records.items()}
+        standings.division_records = {symbol: list(record) for symbol, record in self.division_records.items()}
+        standings.head_to_head = self.head_to_head.copy()
+        standings._seeding = self._seeding
+        return standings
+
+    def record(self, winner, loser):
+        self.records[winner][0] += 1
+        self.records[loser][1] += 1
+        if self.conferences[winner] == self.conferences[loser]:
+            self.conference_records[winner][0] += 1
+            self.conference_records[loser][1] += 1
+        if DIVISIONS.get(winner) is not None and DIVISIONS.get(winner) == DIVISIONS.get(loser):
+            self.division_records[winner][0] += 1
+            self.division_records[loser][1] += 1
+        self.head_to_head[winner, loser] += 1
+        self._seeding = None
+
+    def win_percentage(self, symbol, records=None):
+        wins, losses = (records or self.records)[symbol]
+        return get_percentage(wins, wins + losses)
+
+    def tiebreakers(self, symbol, tied):
+        """Sort key of a team among the teams it is tied with"""
+        wins = sum(self.head_to_head[symbol, other] for other in tied)
+        games = wins + sum(self.head_to_head[other, symbol] for other in tied)
+        head_to_head = get_percentage(wins, games, default=.5)
+
+        divisions = set(DIVISIONS.get(team) for team in tied | set([symbol]))
+        same_division = len(divisions) == 1 and None not in divisions
+        division = self.win_percentage(symbol, self.division_records) if same_division else 0
+
+        return (-head_to_head, -division, -self.win_percentage(symbol, self.conference_records), random.random())
+
+    def rank(self, conference):
+        members = [symbol for symbol, c in self.conferences.items() if c == conference]
+        level = collections.defaultdict(set)
+        for symbol in members:
+            level[self.win_percentage(symbol)].add(symbol)
+
+        def key(symbol):
+            percentage = self.win_percentage(symbol)
+            return (-percentage,) + self.tiebreakers(symbol, level[percentage] - set([symbol]))
+        return sorted(members, key=key)
+
+    @property
+    def seeding(self):
+        """conference -> symbols in seed order"""
+        if self._seeding is None:
+            self._seeding = {conference: self.rank(conference) for conference in (WESTERN_CONFERENCE, EASTERN_CONFERENCE)}
+        return self._seeding
+
+
 class Season:
 
     k_factor = 20
 
-    def __init__(self, year, teams, games):
+    def __init__(self, year, teams, games, standings=None):
         self.year = year
         self.teams = {team.symbol: team for team in teams}
         # we need to guarantee the list of games is in order of date played
         # especially as we compute rating changes:
         self.games = list(sorted(games, key=lambda x: x.date))
 
+        # results are tallied once here (or handed over already tallied) and
+        # from then on as update_ratings and simulate_remaining record them
+        self.unrecorded_games = set(id(game) for game in self.games if not game.is_complete)
+        if standings is None:
+            standings = Standings({symbol: team.conference for symbol, team in self.teams.items()})
+            for game in self.games:
+                if game.is_complete:
+                    standings.record(game.winner, game.loser)
+        self.standings = standings
+
+    def record_result(self, game):
+        if id(game) in self.unrecorded_games:
+            self.unrecorded_games.remove(id(game))
+            self.standings.record(game.winner, game.loser)
+
     # def __getitem__(self, key):
         # return self.games[key]
 
     def update_ratings(self, game, k_factor=None):
         if k_factor is None:
             k_factor = self.k_factor
-        home_team = self.teams[game.home_team]
-        away_team = self.teams[game.away_team]
-        margin = game.home_points - game.away_points
-        home_team_won = margin > 0
-
-        numerator = (abs(margin) + 3)**0.8
-
-        denom = 7.5 + .0006 * (home_team.current_rating - away_team.current_rating)
-
-        expected_outcome = get_expected_outcome(home_team.current_rating, away_team.current_rating)
-        if game.home_points > game.away_points:
-            outcome = (1 - expected_outcome)
-        else:
-            outcome = -expected_outcome
-        home_change = k_factor * (numerator / denom) * outcome
-        away_change = -home_change
-        home_team.update_rating(game.date, home_change, home_team_won)
-        away_team.update_rating(game.date, away_change, not home_team_won)
+        home_change = get_rating_change(self.teams[game.home_team].current_rating,
+            self.teams[game.away_team].current_rating, game.home_points, game.away_points, k_factor)
+        self.apply_rating_change(game, home_change)
+        return home_change
+
+    def apply_rating_change(self, game, home_change):
+        """Records a game whose rating change is already known, e.g. one
+        read back from the stored history, without recomputing it"""
+        home_team_won = game.home_points > game.away_points
+        self.teams[game.home_team].update_rating(game.date, home_change, home_team_won)
+        self.teams[game.away_team].update_rating(game.date, -home_change, not home_team_won)
+        self.record_result(game)
 
     def play_through_season(self, stop_date=None):
         for game in self.games:
@@ -279,6 +496,7 @@ class Season:
             home_team = self.teams[game.home_team]
             away_team = self.teams[game.away_team]
             game.simulate(home_team.current_rating, away_team.current_rating)
+            self.record_result(game)
 
     @property
     def first_day(self):
@@ -304,39 +522,237 @@ class Season:
 
     @property
     def current_standings(self):
-        team_records = {}
+        records = self.standings.records
+        seeding = self.standings.seeding
+        return tuple([(team, tuple(records[team]), self.teams[team]) for team in seeding[conference]]
+            for conference in (WESTERN_CONFERENCE, EASTERN_CONFERENCE))
+
+    def snapshot(self):
+        """Freezes the current ratings, records and results of the season"""
+        teams = tuple(TeamState(team.symbol, team.conference, team.current_rating, team.wins, team.losses)
+            for team in self.teams.values())
+        completed_games = tuple(GameResult(g.home_team, g.away_team, g.date, g.home_points, g.away_points)
+            for g in self.games if g.is_complete)
+        remaining_games = tuple((g.home_team, g.away_team, g.date) for g in self.games if not g.is_complete)
+        date = max((g.date for g in completed_games), default=min(team.start_date for team in self.teams.values()))
+        standings = self.standings.copy()
         for game in self.games:
-            if not game.is_complete:
-                continue
-            home = game.home_team
-            away = game.away_team
-            if home not in team_records:
-                team_records[home] = [0, 0]
-            if away not in team_records:
-                team_records[away] = [0, 0]
-
-            assert game.home_points != game.away_points
-            if game.home_points > game.away_points:
-                team_records[home][0] += 1
-                team_records[away][1] += 1
-            else:
-                team_records[home][1] += 1
-                team_records[away][0] += 1
-        team_records = {k: tuple(v) for k, v in team_records.items()}
-
-        western = [(team, record, self.teams[team]) for team, record in team_records.items() if self.teams[team].conference == WESTERN_CONFERENCE]
-        eastern = [(team, record, self.teams[team]) for team, record in team_records.items() if self.teams[team].conference == EASTERN_CONFERENCE]
-
-        def sort_standings(standings):
-            return list(reversed(sorted(standings, key=lambda x: x[1])))
-
-        return sort_standings(western), sort_standings(eastern)
+            if id(game) in self.unrecorded_games and game.is_complete:
+                standings.record(game.winner, game.loser)
+        return SeasonSnapshot(self.year, date, teams, completed_games, remaining_games, standings)
 
     def __iter__(self):
         for game in self.games:
             yield game
 
 
+TeamState = collections.namedtuple('TeamState', ['symbol', 'conference', 'rating', 'wins', 'losses'])
+
+
+class GameResult(collections.namedtuple('GameResult', ['home_team', 'away_team', 'date', 'home_points', 'away_points'])):
+
+    """Immutable completed game, shared between every fork of a snapshot."""
+
+    is_complete = True
+    is_simulated = False
+
+    @property
+    def winner(self):
+        return self.home_team if self.home_points > self.away_points else self.away_team
+
+    @property
+    def loser(self):
+        return self.away_team if self.winner == self.home_team else self.home_team
+
+    def to_dict(self):
+        return dict(self._asdict(), is_simulated=self.is_simulated)
+
+
+class SeasonSnapshot(collections.namedtuple('SeasonSnapshot',
+        ['year', 'date', 'teams', 'completed_games', 'remaining_games', 'standings'])):
+
+    """Frozen state of a season once its completed games have been played
+    through: each team's rating and record, the completed results, the
+    (home, away, date) of every unplayed game and the standings counters.
+    The standings are never written to, forks get their own copy.
+
+    The snapshot is built once and then forked for every trial. A fork
+    shares the completed results and only copies what a simulation writes
+    to: the teams and the unplayed games.
+    """
+
+    @classmethod
+    def from_games(cls, year, teams, games):
+        # play through fresh copies so the caller's teams and games are left untouched
+        teams = [Team(team.symbol, team.start_date, team.conference, team.start_rating) for team in teams]
+        season = Season(year, teams, Game.from_list_of_games(games))
+        season.play_through_season()
+        return season.snapshot()
+
+    def fork(self):
+        teams = []
+        for state in self.teams:
+            team = Team(state.symbol, self.date, state.conference, start_rating=state.rating)
+            team.wins, team.losses = state.wins, state.losses
+            teams.append(team)
+        games = list(self.completed_games)
+        games.extend(Game(home_team, away_team, date) for home_team, away_team, date in self.remaining_games)
+        return Season(self.year, teams, games, standings=self.standings.copy())
+
+
+def iter_daily_snapshots(year, teams, games, dates):
+    """Walks the season once and yields (date, snapshot) at the start of each
+    of `dates`: games played before that date are played through, every game
+    on or after it is left to be simulated.
+
+    Backfilling a season this way costs one replay instead of one per date.
+    """
+    teams = [Team(team.symbol, team.start_date, team.conference, team.start_rating) for team in teams]
+    # the walk starts from an empty season and fills in the scores as it goes
+    results = sorted(games, key=lambda x: x.date)
+    unplayed = [Game(g.home_team if isinstance(g.home_team, str) else g.home_team.symbol,
+        g.away_team if isinstance(g.away_team, str) else g.away_team.symbol, g.date) for g in results]
+    season = Season(year, teams, unplayed)
+
+    i = 0
+    for date in sorted(dates):
+        while i < len(results) and results[i].date.date() < date:
+            if results[i].home_points is not None and results[i].away_points is not None:
+                game = season.games[i]
+                game.home_points, game.away_points = results[i].home_points, results[i].away_points
+                season.update_ratings(game)
+            i += 1
+        yield date, season.snapshot()
+
+
+RatedGame = collections.namedtuple('RatedGame',
+    ['game_id', 'season', 'date', 'home_team', 'away_team', 'home_won', 'home_change', 'home_rating', 'away_rating'])
+
+
+class RatingEngine:
+
+    """Rates games of any number of seasons in a single pass.
+
+    Games are fed in date order as plain (game_id, season, date, home_team,
+    away_team, home_points, away_points) tuples and only the current rating
+    of each team is kept, in an array indexed by team. When the season
+    changes every team keeps `carryover` of its distance from the start
+    rating; teams seen for the first time start at the start rating.
+    """
+
+    def __init__(self, start_rating=1500, carryover=None, k_factor=Season.k_factor):
+        self.start_rating = start_rating
+        self.carryover = Config.ELO_CARRYOVER if carryover is None else carryover
+        self.k_factor = k_factor
+        self.index = {}
+        self.ratings = np.zeros(0)
+        self.season = None
+
+    def team_index(self, team):
+        if team not in self.index:
+            self.index[team] = len(self.index)
+            if len(self.index) > len(self.ratings):
+                self.ratings = np.concatenate([self.ratings, np.full(max(32, len(self.ratings)), float(self.start_rating))])
+        return self.index[team]
+
+    def start_season(self, season):
+        self.season = season
+        self.ratings = regress_rating(self.ratings, self.carryover, self.start_rating)
+
+    def rate(self, games):
+        """Generates a RatedGame with the change and the ratings after the game
+        for every game"""
+        for game_id, season, date, home_team, away_team, home_points, away_points in games:
+            if season != self.season:
+                self.start_season(season)
+            home, away = self.team_index(home_team), self.team_index(away_team)
+            ratings = self.ratings
+            home_rating, away_rating = float(ratings[home]), float(ratings[away])
+            home_change = get_rating_change(home_rating, away_rating, home_points, away_points, self.k_factor)
+            ratings[home] = home_rating = home_rating + home_change
+            ratings[away] = away_rating = away_rating - home_change
+            yield RatedGame(game_id, season, date, home_team, away_team, home_points > away_points, home_change,
+                home_rating, away_rating)
+
+    @property
+    def current_ratings(self):
+        return {team: float(self.ratings[i]) for team, i in self.index.items()}
+
+
+RatingParameters = collections.namedtuple('RatingParameters',
+    ['k_factor', 'mov_offset', 'mov_exponent', 'denom_base', 'denom_slope', 'carryover'])
+RatingParameters.__new__.__defaults__ = (20, 3, 0.8, 7.5, .0006, 0.)
+
+
+class ParameterSweep:
+
+    """Replays games under every combination of a grid of `RatingParameters`
+    at once and scores the pre-game win probabilities of each.
+
+    Ratings are held as a (teams x combinations) array, so every game is one
+    vectorized update over the whole grid instead of a replay per setting.
+    Games are fed the same way as to `RatingEngine`.
+    """
+
+    def __init__(self, grid, start_rating=1500):
+        """`grid` maps RatingParameters fields to the values to try, fields
+        left out keep their defaults"""
+        fields = RatingParameters._fields
+        values = [grid.get(field, [getattr(RatingParameters(), field)]) for field in fields]
+        self.parameters = [RatingParameters(*combination) for combination in itertools.product(*values)]
+        self.constants = {field: np.array([getattr(p, field) for p in self.parameters], dtype=float)
+            for field in fields}
+        self.start_rating = start_rating
+        self.index = {}
+        self.ratings = np.zeros((0, len(self.parameters)))
+        self.season = None
+        self.games = 0
+        self.log_loss = np.zeros(len(self.parameters))
+        self.brier_score = np.zeros(len(self.parameters))
+
+    def team_index(self, team):
+        if team not in self.index:
+            self.index[team] = len(self.index)
+            if len(self.index) > len(self.ratings):
+                self.ratings = np.concatenate([self.ratings,
+                    np.full((max(32, len(self.ratings)), len(self.parameters)), float(self.start_rating))])
+        return self.index[team]
+
+    def add(self, games):
+        constants = self.constants
+        change_constants = {field: constants[field] for field in RatingParameters._fields if field != 'carryover'}
+        for _, season, _, home_team, away_team, home_points, away_points in games:
+            if season != self.season:
+                self.season = season
+                self.ratings = regress_rating(self.ratings, constants['carryover'], self.start_rating)
+            home, away = self.team_index(home_team), self.team_index(away_team)
+            home_rating, away_rating = self.ratings[home], self.ratings[away]
+
+            expected_outcome = np.clip(get_expected_outcome(home_rating, away_rating), 1e-15, 1 - 1e-15)
+            if home_points > away_points:
+                self.log_loss -= np.log(expected_outcome)
+                self.brier_score += (1 - expected_outcome)**2
+            else:
+                self.log_loss -= np.log(1 - expected_outcome)
+                self.brier_score += expected_outcome**2
+            self.games += 1
+
+            home_change = get_rating_change(home_rating, away_rating, home_points, away_points, **change_constants)
+            home_rating += home_change
+            away_rating -= home_change
+
+    def scores(self):
+        """-> list of (RatingParameters, mean log-loss, mean Brier score) from
+        best to worst log-loss"""
+        games = max(self.games, 1)
+        order = np.argsort(self.log_loss)
+        return [(self.parameters[i], self.log_loss[i] / games, self.brier_score[i] / games) for i in order]
+
+    @property
+    def best_parameters(self):
+        return self.parameters[int(np.argmin(self.log_loss))]
+
+
 class PlayoffSimulator:
 
     def __init__(self, year, teams, standings, games=None):
@@ -375,6 +791,17 @@ class PlayoffSimulator:
         champion = championship.simulate_winner()
         return champion
 
+    def round_probabilities(self):
+        """Exact probability of each playoff team winning its first round,
+        conference semifinal, conference final and the finals"""
+        west, east = self.standings
+        teams = [west[i][2] for i in BRACKET_ORDER] + [east[i][2] for i in BRACKET_ORDER]
+        ratings = np.array([team.current_rating for team in teams])
+        series_probabilities = get_series_win_probability(get_expected_outcome(ratings[:, None], ratings[None, :]))
+
+        probabilities = get_bracket_probabilities(np.arange(len(teams))[None, :], series_probabilities)[0]
+        return {team.symbol: list(p) for team, p in zip(teams, probabilities)}
+
 
 class PlayoffRound:
 
@@ -383,12 +810,16 @@ class PlayoffRound:
         self.team1 = team1
         self.team2 = team2
 
+    @property
+    def team1_win_probability(self):
+        return get_series_win_probability(get_expected_outcome(self.team1.current_rating, self.team2.current_rating))
+
     def simulate_winner(self):
         team1_wins = 0
         team2_wins = 0
         team1_win_probability = get_expected_outcome(self.team1.current_rating, self.team2.current_rating)
 
-        while (team1_wins < 4 or team2_wins < 4):
+        while team1_wins < 4 and team2_wins < 4:
             if random.random() < team1_win_probability:
                 team1_wins += 1
             else:
@@ -397,61 +828,476 @@ class PlayoffRound:
         return self.team1 if team1_wins > team2_wins else self.team2
 
 
+def get_standard_error(totals, squares, trials):
+    """Monte Carlo standard error of a mean, from the sums of the values and of
+    their squares over `trials` trials"""
+    if trials < 2:
+        return np.full(np.shape(totals), np.inf)
+    means = np.asarray(totals) / trials
+    variances = np.maximum(np.asarray(squares) / trials - means ** 2, 0) * trials / (trials - 1)
+    return np.sqrt(variances / trials)
+
+
+SimulatedBatch = collections.namedtuple('SimulatedBatch', ['win_totals', 'seedings'])
+
+
+class Accumulator:
+
+    """Folds batches of simulated seasons into running totals, so a
+    simulation only ever holds one batch in memory.
+
+    `start` is called once the simulator has laid out its arrays, `add` with
+    every batch and `merge` to combine the totals of parallel workers.
+    """
+
+    trials = 0
+
+    def start(self, simulator):
+        self.symbols = simulator.symbols
+        self.trials = 0
+
+    def add(self, batch):
+        self.trials += len(batch.win_totals)
+
+    def merge(self, other):
+        self.trials += other.trials
+
+    def _to_dict(self, values):
+        return {symbol: value for symbol, value in zip(self.symbols, values)}
+
+
+class SeedDistribution(Accumulator):
+
+    """How often each team finished at each seed of its conference"""
+
+    def start(self, simulator):
+        super().start(simulator)
+        seeds = max(len(members) for members in simulator.conferences.values())
+        self.counts = np.zeros((len(self.symbols), seeds), dtype=np.int64)
+
+    def add(self, batch):
+        super().add(batch)
+        for seeds in batch.seedings.values():
+            for seed in range(seeds.shape[1]):
+                self.counts[:, seed] += np.bincount(seeds[:, seed], minlength=len(self.symbols))
+
+    def merge(self, other):
+        super().merge(other)
+        self.counts += other.counts
+
+    def probabilities(self, seeds):
+        """Probability of each team finishing in the top `seeds` of its conference"""
+        return self._to_dict(self.counts[:, :seeds].sum(axis=1) / self.trials)
+
+    def standard_errors(self, seeds):
+        """Standard error of each of `probabilities(seeds)`"""
+        # the outcome of each trial is 0 or 1 so the squares sum to the total
+        totals = self.counts[:, :seeds].sum(axis=1)
+        return self._to_dict(get_standard_error(totals, totals, self.trials))
+
+    @property
+    def playoff_probabilities(self):
+        return self.probabilities(8)
+
+    @property
+    def top_seed_probabilities(self):
+        return self.probabilities(1)
+
+
+class WinTotalHistogram(Accumulator):
+
+    """How often each team finished with each number of wins"""
+
+    def start(self, simulator):
+        super().start(simulator)
+        self.counts = np.zeros((len(self.symbols), int(simulator.games_played.max()) + 1), dtype=np.int64)
+
+    def add(self, batch):
+        super().add(batch)
+        team_count, width = self.counts.shape
+        offsets = batch.win_totals + width * np.arange(team_count)
+        self.counts += np.bincount(offsets.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+    def merge(self, other):
+        super().merge(other)
+        self.counts += other.counts
+
+    def percentiles(self, percentiles=(10, 50, 90)):
+        """Projected win totals of each team at the given percentiles"""
+        cumulative = self.counts.cumsum(axis=1) / self.trials
+        return self._to_dict([[int(np.searchsorted(c, q / 100.)) for q in percentiles] for c in cumulative])
+
+    @property
+    def mean_win_totals(self):
+        return self._to_dict(self.counts @ np.arange(self.counts.shape[1]) / self.trials)
+
+
+class RoundProbabilities(Accumulator):
+
+    """Probability of each team winning every playoff round, averaged over the
+    simulated seedings. Each distinct bracket of a batch is solved exactly once."""
+
+    rounds = 4
+
+    def start(self, simulator):
+        super().start(simulator)
+        self.series_probabilities = get_series_win_probability(
+            get_expected_outcome(simulator.ratings[:, None], simulator.ratings[None, :]))
+        self.totals = np.zeros((len(self.symbols), self.rounds))
+        # the bracket probabilities differ from trial to trial, so the
+        # standard errors need the sums of their squares as well
+        self.squares = np.zeros((len(self.symbols), self.rounds))
+
+    def add(self, batch):
+        super().add(batch)
+        west = batch.seedings[WESTERN_CONFERENCE][:, BRACKET_ORDER]
+        east = batch.seedings[EASTERN_CONFERENCE][:, BRACKET_ORDER]
+
+        # sorting rows is slow so pack each conference bracket into one integer
+        # and dedupe on the pair of conference bracket ids instead
+        bits = max(1, (len(self.symbols) - 1).bit_length())
+        shifts = bits * np.arange(len(BRACKET_ORDER), dtype=np.int64)
+        west_ids, east_ids = [np.unique((seeds.astype(np.int64) << shifts).sum(axis=1), return_inverse=True)[1].ravel()
+            for seeds in (west, east)]
+        _, first, counts = np.unique(west_ids * (east_ids.max() + 1) + east_ids, return_index=True, return_counts=True)
+        brackets = np.concatenate([west[first], east[first]], axis=1)
+
+        probabilities = get_bracket_probabilities(brackets, self.series_probabilities)
+        weights = probabilities * counts[:, None, None]
+        squares = weights * probabilities
+        teams = brackets.ravel()
+        for i in range(self.rounds):
+            self.totals[:, i] += np.bincount(teams, weights=weights[:, :, i].ravel(), minlength=len(self.symbols))
+            self.squares[:, i] += np.bincount(teams, weights=squares[:, :, i].ravel(), minlength=len(self.symbols))
+
+    def merge(self, other):
+        super().merge(other)
+        self.totals += other.totals
+        self.squares += other.squares
+
+    @property
+    def probabilities(self):
+        return self._to_dict([list(p) for p in self.totals / self.trials])
+
+    @property
+    def championship_probabilities(self):
+        return self._to_dict(self.totals[:, -1] / self.trials)
+
+    @property
+    def championship_standard_errors(self):
+        return self._to_dict(get_standard_error(self.totals[:, -1], self.squares[:, -1], self.trials))
+
+
 class Simulator:
 
-    def __init__(self, year, teams, games):
+    """Monte Carlo simulation of the remainder of a season.
+
+    Ratings are held fixed for unplayed games (see `Season.simulate_remaining`)
+    so every remaining game has a single home win probability. Instead of
+    simulating one `Season` at a time we draw a (trials x remaining games)
+    matrix of outcomes and reduce it straight to win totals and seedings.
+    Each batch is folded into the accumulators and then dropped; extra
+    accumulators can be plugged in alongside the built in ones.
+    """
+
+    batch_size = 10000
+
+    def __init__(self, year, teams, games, snapshot=None, workers=1, seed=None, accumulators=()):
         self.year = year
         self.teams = teams
         self.games = games
+        # the completed games are only ever played through once
+        self.snapshot = snapshot if snapshot is not None else SeasonSnapshot.from_games(year, teams, games)
+
+        # trials are split into one chunk per worker and every chunk draws
+        # from its own stream spawned off the seed, so a given seed and
+        # worker count always reproduce the same results
+        self.workers = workers
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+        # teams are laid out by symbol, not in the order the season happened
+        # to hold them, so the draws of a seed always land on the same teams
+        self.team_states = sorted(self.snapshot.teams, key=lambda team: team.symbol)
+        self.symbols = [team.symbol for team in self.team_states]
+        self.seed_distribution = SeedDistribution()
+        self.win_total_histogram = WinTotalHistogram()
+        self.round_probabilities = RoundProbabilities()
+        self.accumulators = [self.seed_distribution, self.win_total_histogram, self.round_probabilities]
+        self.accumulators.extend(accumulators)
+        self.is_prepared = False
 
-        self.simulated_seasons = []
+    @classmethod
+    def from_snapshot(cls, snapshot, workers=1, seed=None, accumulators=()):
+        return cls(snapshot.year, snapshot.teams, None, snapshot=snapshot, workers=workers, seed=seed,
+            accumulators=accumulators)
 
     def create_season(self):
-        # need to create a new copy of games because as we simulate the games
-        # we are overriding the attributes
-        games = Game.from_list_of_games(self.games)
-        return Season(self.year, self.teams, games)
+        """A played through copy of the season that is safe to simulate"""
+        return self.snapshot.fork()
+
+    def simulate_season(self):
+        season = self.create_season()
+        season.simulate_remaining()
+        return season
+
+    def prepare_arrays(self):
+        """Lays out the remaining schedule of the snapshot as arrays of team
+        indices and home win probabilities, along with everything the
+        tiebreakers need."""
+        teams = self.team_states
+        standings = self.snapshot.standings
+        index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        remaining = self.snapshot.remaining_games
+        self.home = home = np.array([index[home_team] for home_team, _, _ in remaining], dtype=np.intp)
+        self.away = away = np.array([index[away_team] for _, away_team, _ in remaining], dtype=np.intp)
+
+        self.ratings = np.array([team.rating for team in teams])
+        self.home_win_probabilities = get_expected_outcome(self.ratings[home], self.ratings[away])
+
+        team_count = len(self.symbols)
+        self.home_games = home_games = np.zeros((len(remaining), team_count), dtype=np.float32)
+        home_games[np.arange(len(remaining)), home] = 1
+        self.away_games = away_games = np.zeros((len(remaining), team_count), dtype=np.float32)
+        away_games[np.arange(len(remaining)), away] = 1
+
+        # every away game counts as a win unless the home team won it, so
+        # wins = base + away games + home_won @ (home - away)
+        self.home_minus_away = home_games - away_games
+        self.base_wins = np.array([team.wins for team in teams]) + away_games.sum(axis=0)
+        self.games_played = np.array([team.wins + team.losses for team in teams]) + \
+            home_games.sum(axis=0) + away_games.sum(axis=0)
+        self.conferences = {
+            conference: np.array([i for i, team in enumerate(teams) if team.conference == conference], dtype=np.intp)
+            for conference in (WESTERN_CONFERENCE, EASTERN_CONFERENCE)}
+
+        conferences = np.array([team.conference for team in teams])
+        divisions = np.array([DIVISIONS.get(symbol, '') for symbol in self.symbols])
+        self.same_conference = conferences[:, None] == conferences[None, :]
+        self.same_division = (divisions[:, None] == divisions[None, :]) & (divisions != '')[:, None]
+
+        # conference and division records work like the overall record, only
+        # counting the games within the conference or division. Both are laid
+        # side by side, conference then division, so one matmul gives both
+        base_wins, home_minus_away, games = [], [], []
+        for mask, records in ((self.same_conference, standings.conference_records),
+                (self.same_division, standings.division_records)):
+            within = mask[home, away][:, None]
+            base_wins.append(np.array([records[symbol][0] for symbol in self.symbols]) +
+                (away_games * within).sum(axis=0))
+            home_minus_away.append(self.home_minus_away * within)
+            games.append(np.array([sum(records[symbol]) for symbol in self.symbols]) +
+                ((home_games + away_games) * within).sum(axis=0))
+        self.tiebreak_base_wins = np.concatenate(base_wins)
+        self.tiebreak_home_minus_away = np.concatenate(home_minus_away, axis=1)
+        self.tiebreak_games = np.maximum(np.concatenate(games), 1)
+        # and the overall record in front of them, for one matmul per batch
+        self.record_base_wins = np.concatenate([self.base_wins, self.tiebreak_base_wins])
+        self.record_home_minus_away = np.concatenate([self.home_minus_away, self.tiebreak_home_minus_away], axis=1)
+
+        # weights summed over the teams a team is tied with: head-to-head wins
+        # and games in the completed games and whether they are outside its division
+        head_to_head = np.array([[standings.head_to_head[winner, loser] for loser in self.symbols]
+            for winner in self.symbols], dtype=np.float32)
+        self.tied_weights = np.stack([head_to_head, head_to_head + head_to_head.T, ~self.same_division], axis=-1)
+        self.tied_weights = self.tied_weights.astype(np.float32)
+        # the remaining games between each pair of teams i * teams + j, padded
+        # out to the most any two teams have left. i's wins among them are
+        # sum(home_won[games] * signs + offsets), 1 - home_won where i is away
+        between = collections.defaultdict(list)
+        for game, (home_team, away_team) in enumerate(zip(home, away)):
+            between[home_team, away_team].append(game)
+            between[away_team, home_team].append(game)
+        most_games = max([len(games) for games in between.values()] + [1])
+        self.pair_games = np.zeros((team_count * team_count, most_games), dtype=np.intp)
+        self.pair_signs = np.zeros((team_count * team_count, most_games), dtype=np.float32)
+        self.pair_offsets = np.zeros((team_count * team_count, most_games), dtype=np.float32)
+        self.pair_game_counts = np.zeros(team_count * team_count, dtype=np.float32)
+        for (i, j), games in between.items():
+            hosts = home[games] == i
+            self.pair_games[i * team_count + j, :len(games)] = games
+            self.pair_signs[i * team_count + j, :len(games)] = np.where(hosts, 1, -1)
+            self.pair_offsets[i * team_count + j, :len(games)] = ~hosts
+            self.pair_game_counts[i * team_count + j] = len(games)
+        self.tied_weights = self.tied_weights.reshape(team_count * team_count, -1)
+
+    def simulate_outcomes(self, trials, rng):
+        """-> (trials, remaining games) array, 1 where the home team won"""
+        # single precision draws are cheaper and still resolve a
+        # probability to 2**-24
+        probabilities = self.home_win_probabilities.astype(np.float32)
+        return (rng.random((trials, len(probabilities)), dtype=np.float32) < probabilities).astype(np.float32)
+
+    def get_records(self, home_won):
+        """-> (trials, teams) array of final win totals and (trials, 2 * teams)
+        array of conference then division wins"""
+        records = self.record_base_wins + home_won @ self.record_home_minus_away
+        return np.rint(records[:, :len(self.symbols)]).astype(np.int16), records[:, len(self.symbols):]
+
+    def rank_conferences(self, home_won, win_totals, tiebreak_wins, rng):
+        """-> dict of conference to (trials, conference teams) array of team
+        indices ordered by seed, using the same tiebreakers as `Standings`."""
+        win_percentages = win_totals / np.maximum(self.games_played, 1)
+        conference_percentages, division_percentages = np.split(tiebreak_wins / self.tiebreak_games, 2, axis=1)
+
+        lots = rng.random(win_totals.shape)
+
+        # the head-to-head record among the teams level with each other, from
+        # the completed games of the snapshot plus the simulated ones, summed
+        # over just the pairs of teams that are level in a trial
+        team_count = len(self.symbols)
+        trials, team, rival = [], [], []
+        for members in self.conferences.values():
+            percentages = win_percentages[:, members]
+            level = (percentages[:, :, None] == percentages[:, None, :]) & \
+                np.triu(np.ones((len(members), len(members)), dtype=bool), 1)
+            level_trials, pair = np.divmod(np.flatnonzero(level), len(members) ** 2)
+            trials.append(level_trials)
+            team.append(members[pair // len(members)])
+            rival.append(members[pair % len(members)])
+        trials, team, rival = np.concatenate(trials), np.concatenate(team), np.concatenate(rival)
+
+        pair = team * team_count + rival
+        home_won_games = np.take(home_won, trials[:, None] * home_won.shape[1] + self.pair_games[pair])
+        won = (home_won_games * self.pair_signs[pair] + self.pair_offsets[pair]).sum(axis=1)
+        remaining = self.pair_game_counts[pair]
+        weights = self.tied_weights[pair]
+        # each pair counts towards both teams' records
+        rows = np.concatenate([trials * team_count + team, trials * team_count + rival])
+        size = win_totals.size
+        head_to_head_wins = np.bincount(rows, np.concatenate([weights[:, 0] + won,
+            self.tied_weights[rival * team_count + team, 0] + remaining - won]), minlength=size)
+        head_to_head_games = np.bincount(rows, np.tile(weights[:, 1] + remaining, 2), minlength=size)
+        head_to_head_percentages = np.where(head_to_head_games > 0,
+            head_to_head_wins / np.maximum(head_to_head_games, 1), .5).reshape(win_totals.shape)
+
+        # a team without a division counts as outside its own
+        level = np.zeros(size, dtype=bool)
+        level[rows] = True
+        outside_division = (np.bincount(rows, np.tile(weights[:, 2], 2), minlength=size) > 0) | \
+            (level & np.tile(~self.same_division.diagonal(), len(win_totals)))
+        division_percentages = np.where(outside_division.reshape(win_totals.shape), 0, division_percentages)
+
+        keys = [(win_percentages, self.games_played.max()),
+            (head_to_head_percentages, max(2, head_to_head_games.max())),
+            (division_percentages, self.tiebreak_games[team_count:].max()),
+            (conference_percentages, self.tiebreak_games[:team_count].max())]
+        codes, capacity = get_tiebreak_codes(keys)
+        seedings = {}
+        for conference, members in self.conferences.items():
+            if capacity * len(members) < 2 ** 63:
+                # the draw of lots is each team's rank among the lots of its conference
+                lot_ranks = np.argsort(np.argsort(lots[:, members], axis=1), axis=1)
+                order = np.argsort(codes[:, members] * len(members) + lot_ranks, axis=1)
+            else:
+                order = np.lexsort((lots[:, members],) +
+                    tuple(-percentages[:, members] for percentages, _ in reversed(keys)))
+            seedings[conference] = members[order]
+        return seedings
+
+    def simulate_chunk(self, trials, seed_sequence, accumulators):
+        """Simulates `trials` seasons in batches from a single random stream
+        and folds them into fresh copies of `accumulators`"""
+        rng = np.random.default_rng(seed_sequence)
+        accumulators = copy.deepcopy(accumulators)
+        for accumulator in accumulators:
+            accumulator.start(self)
+
+        for start in range(0, trials, self.batch_size):
+            home_won = self.simulate_outcomes(min(self.batch_size, trials - start), rng)
+            win_totals, tiebreak_wins = self.get_records(home_won)
+            batch = SimulatedBatch(win_totals, self.rank_conferences(home_won, win_totals, tiebreak_wins, rng))
+            for accumulator in accumulators:
+                accumulator.add(batch)
+        return accumulators
+
+    def create_pool(self):
+        """-> pool of `workers` processes, each holding the snapshot, so tasks
+        only carry a trial count and a seed"""
+        return multiprocessing.Pool(self.workers, initializer=_init_worker,
+            initargs=(self.snapshot, self.accumulators))
+
+    def simulate_many_seasons(self, trials=1000, pool=None):
+        """Runs `trials` more simulations. Calling it again keeps adding to the
+        same totals. With several workers the trials run on `pool`, or on a
+        pool created for this call."""
+        if not self.is_prepared:
+            self.prepare_arrays()
+            for accumulator in self.accumulators:
+                accumulator.start(self)
+            self.is_prepared = True
+
+        streams = self.seed_sequence.spawn(self.workers)
+        chunks = [(trials // self.workers + (i < trials % self.workers), stream) for i, stream in enumerate(streams)]
+        if self.workers > 1 and pool is not None:
+            results = pool.map(_simulate_chunk, chunks)
+        elif self.workers > 1:
+            with self.create_pool() as pool:
+                results = pool.map(_simulate_chunk, chunks)
+        else:
+            results = [self.simulate_chunk(trials, stream, self.accumulators) for trials, stream in chunks]
+
+        for accumulators in results:
+            for accumulator, chunk_accumulator in zip(self.accumulators, accumulators):
+                accumulator.merge(chunk_accumulator)
+
+    def simulate_until_precise(self, tolerance=.005, max_trials=100000, batch_trials=1000):
+        """Simulates `batch_trials` seasons at a time until the standard error
+        of every team's playoff, top seed and championship probability is at
+        most `tolerance`, or `max_trials` seasons have been simulated. Every
+        batch runs on the same pool of workers."""
+        pool = self.create_pool() if self.workers > 1 else None
+        try:
+            while self.trials < max_trials:
+                self.simulate_many_seasons(min(batch_trials, max_trials - self.trials), pool)
+                if self.max_standard_error <= tolerance:
+                    break
+        finally:
+            if pool is not None:
+                pool.terminate()
 
+    @property
+    def trials(self):
+        return self.seed_distribution.trials
 
-    def simulate_many_seasons(self, trials=1000):
-        for _ in range(trials):
-            season = self.create_season()
-            season.play_through_season()
-            season.simulate_remaining()
+    @property
+    def standard_errors(self):
+        """-> {team: {outcome: standard error}} of the playoff, top seed and
+        championship probabilities"""
+        outcomes = dict(playoff=self.seed_distribution.standard_errors(8),
+            top_seed=self.seed_distribution.standard_errors(1),
+            champion=self.round_probabilities.championship_standard_errors)
+        return {symbol: {outcome: errors[symbol] for outcome, errors in outcomes.items()} for symbol in self.symbols}
 
-            self.simulated_seasons.append(season)
+    @property
+    def max_standard_error(self):
+        return max(max(errors.values()) for errors in self.standard_errors.values())
 
     @property
     def playoff_probabilities(self):
-        teams = {team.symbol: 0 for team in self.teams}
-        for season in self.simulated_seasons:
-            west, east = season.current_standings
-            for row in itertools.chain(west[:8], east[:8]):
-                team = row[0]
-                teams[team] += 1
-        return {team: counts / len(self.simulated_seasons) for team, counts in teams.items()}
+        return self.seed_distribution.playoff_probabilities
 
     @property
     def top_seed_probabilities(self):
-        teams = {team.symbol: 0 for team in self.teams}
-        for season in self.simulated_seasons:
-            west, east = season.current_standings
-            for row in (west[0], east[0]):
-                team = row[0]
-                teams[team] += 1
-        return {team: counts / len(self.simulated_seasons) for team, counts in teams.items()}
+        return self.seed_distribution.top_seed_probabilities
 
-    def get_championship_probabilities(self):
-        teams = {team.symbol: 0 for team in self.teams}
-        for season in self.simulated_seasons:
-            playoffs = PlayoffSimulator(self.year, self.teams, season.current_standings)
-            champion = playoffs.simulate_playoffs()
-            teams[champion.symbol] += 1
+    def get_round_probabilities(self):
+        return self.round_probabilities.probabilities
 
-        return {team: counts / len(self.simulated_seasons) for team, counts in teams.items()}
+    def get_championship_probabilities(self):
+        return self.round_probabilities.championship_probabilities
 
 
+_worker_simulator = None
+_worker_accumulators = None
 
 
+def _init_worker(snapshot, accumulators):
+    global _worker_simulator, _worker_accumulators
+    _worker_simulator = Simulator.from_snapshot(snapshot)
+    _worker_simulator.prepare_arrays()
+    _worker_accumulators = accumulators
 
 
+def _simulate_chunk(chunk):
+    trials, seed_sequence = chunk
+    return _worker_simulator.simulate_chunk(trials, seed_sequence, _worker_accumulators)
@@ -0,0 +1,60 @@
+"""On-disk cache of fetched pages for conditional requests.
+
+Each URL gets a gzipped copy of the last body fetched from it and a small
+JSON file with its ETag, Last-Modified and the hash of the body. Both are
+replaced atomically, the body first, so the JSON file never names a body
+that was not written.
+"""
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+CacheEntry = collections.namedtuple('CacheEntry', ['url', 'etag', 'last_modified', 'content_hash'])
+
+
+def get_content_hash(body):
+    return hashlib.sha1(body.encode()).hexdigest()
+
+
+class HTTPCache:
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, url, extension):
+        return os.path.join(self.directory, '%s.%s' % (hashlib.sha1(url.encode()).hexdigest(), extension))
+
+    def get(self, url):
+        """-> CacheEntry of the last body stored for `url`, None if there is none"""
+        try:
+            with open(self.get_path(url, 'json')) as f:
+                return CacheEntry(**json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def read_body(self, url):
+        with gzip.open(self.get_path(url, 'html.gz'), 'rt', encoding='utf-8') as f:
+            return f.read()
+
+    def put(self, url, body, etag=None, last_modified=None):
+        """Stores the body fetched from `url` and its validators -> CacheEntry"""
+        os.makedirs(self.directory, exist_ok=True)
+        body_path = self.get_path(url, 'html.gz')
+        with gzip.open(body_path + '.tmp', 'wt', encoding='utf-8') as f:
+            f.write(body)
+        os.replace(body_path + '.tmp', body_path)
+
+        entry = CacheEntry(url, etag, last_modified, get_content_hash(body))
+        entry_path = self.get_path(url, 'json')
+        with open(entry_path + '.tmp', 'w') as f:
+            json.dump(entry._asdict(), f)
+        os.replace(entry_path + '.tmp', entry_path)
+        logger.debug("Cached %s (%s)", url, entry.content_hash)
+        return entry
@@ -0,0 +1,109 @@
+import collections
+import logging
+import multiprocessing
+import os
+import re
+import tarfile
+
+from . import models, scrape
+from .backfill import Progress
+
+
+logger = logging.getLogger(__name__)
+
+
+# team and season of a saved schedule, from names like teams/CLE/2016_games.html
+# or cle_2016_schedule.html
+SCHEDULE_NAME = re.compile(r'(?:^|/)([A-Za-z]{3})[/_-](\d{4})[^/]*\.html?$')
+
+
+def parse_schedule_name(name):
+    """-> (team symbol, season year) of a saved schedule page, None if the
+    name does not say"""
+    match = SCHEDULE_NAME.search(name.replace(os.sep, '/'))
+    if match is None:
+        return None
+    return match.group(1).upper(), int(match.group(2))
+
+
+def iter_archive(path):
+    """Yields (name, raw html) of every schedule page in a directory, read in
+    season order, or in a tarball, read in the order it was packed"""
+    if os.path.isdir(path):
+        names = []
+        for directory, _, filenames in os.walk(path):
+            for filename in filenames:
+                name = os.path.relpath(os.path.join(directory, filename), path)
+                if parse_schedule_name(name) is not None:
+                    names.append(name)
+        for name in sorted(names, key=lambda name: (parse_schedule_name(name)[1], name)):
+            with open(os.path.join(path, name), encoding='utf-8') as f:
+                yield name, f.read()
+        return
+
+    with tarfile.open(path) as archive:
+        for member in archive:
+            if member.isfile() and parse_schedule_name(member.name) is not None:
+                yield member.name, archive.extractfile(member).read().decode('utf-8')
+
+
+def _parse_page(page):
+    name, raw_html = page
+    team, year = parse_schedule_name(name)
+    games, _ = scrape.parse_schedule_page(raw_html)
+    return team, year, games
+
+
+def ingest_archive(path, processes=None, max_pending=None):
+    """Ingests the schedules saved in a directory or tarball without touching
+    the network -> {season year: ScheduleChanges}
+
+    Pages are parsed across a pool of processes while this process inserts.
+    No more than `max_pending` pages (by default four per process) are read
+    and handed to the pool ahead of the inserts, so a slow database holds
+    back the reading instead of filling up memory. A season's games are
+    inserted with `models.Game.insert_schedule_of_games` as soon as the pages
+    move on to another season, so a directory (read in season order) holds
+    one season in memory at a time. A tarball packed in another order inserts
+    a season in several goes, which `insert_games` matches up like repeated
+    scrapes.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    max_pending = max_pending or 4 * processes
+    progress = Progress(None, name='pages')
+    changes = {}
+    season_year, schedules = None, {}
+
+    def insert():
+        season_changes = models.Game.insert_schedule_of_games(season_year, schedules)
+        if season_year in changes:
+            previous = changes[season_year]
+            season_changes = models.ScheduleChanges(previous.inserted + season_changes.inserted,
+                previous.changed + season_changes.changed)
+        changes[season_year] = season_changes
+
+    def collect(result):
+        nonlocal season_year, schedules
+        team, year, games = result.get()
+        if year != season_year and schedules:
+            insert()
+            schedules = {}
+        season_year = year
+        schedules[team] = games
+        progress.update()
+
+    with multiprocessing.Pool(processes) as pool:
+        # results are collected in the order of the pages, so seasons stay together
+        pending = collections.deque()
+        for page in iter_archive(path):
+            pending.append(pool.apply_async(_parse_page, (page,)))
+            while len(pending) >= max_pending:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+        if schedules:
+            insert()
+
+    logger.info("Ingested %s from %s: %s games in %s seasons", progress, path,
+        sum(len(season_changes.inserted) for season_changes in changes.values()), len(changes))
+    return changes
@@ -1,8 +1,15 @@
+import collections
+import csv
+import datetime
+import io
 import logging
 
-from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, Date, Float
+import pytz
+
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, DateTime, Date, Float, Boolean, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import aliased, relationship
+from sqlalchemy.schema import CreateColumn
 
 
 from . import scrape
@@ -11,6 +18,89 @@ from . import db
 
 logger = logging.getLogger(__name__)
 
+EASTERN = pytz.timezone('US/Eastern')
+
+
+# stands for NULL in the CSV handed to COPY, so empty strings stay empty strings
+COPY_NULL = r'\N'
+
+
+def write_copy_csv(rows, columns, f):
+    """Writes `rows` (dicts) as the CSV `COPY ... WITH CSV NULL '\\N'` reads:
+    None as `COPY_NULL`, dates and datetimes in ISO format, with the offset
+    of aware datetimes, and booleans as true/false"""
+    writer = csv.writer(f, lineterminator='\n')
+    for row in rows:
+        values = []
+        for column in columns:
+            value = row[column]
+            if value is None:
+                value = COPY_NULL
+            elif isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif isinstance(value, (datetime.date, datetime.datetime)):
+                value = value.isoformat()
+            values.append(value)
+        writer.writerow(values)
+
+
+def bulk_insert(model, rows):
+    """Inserts a list of dicts into the table of `model` within the current
+    transaction: a COPY on PostgreSQL and a single executemany insert on any
+    other database. Nothing is added to the session."""
+    if not rows:
+        return
+    table = model.__table__
+    if db.engine.dialect.name != 'postgresql':
+        db.session.execute(table.insert(), rows)
+        return
+
+    columns = list(rows[0].keys())
+    buf = io.StringIO()
+    write_copy_csv(rows, columns, buf)
+    buf.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert("COPY %s (%s) FROM STDIN WITH CSV NULL '%s'" % (table.name, ', '.join(columns), COPY_NULL),
+        buf)
+
+
+# a game to insert, with the symbols of its teams
+ScheduledGame = collections.namedtuple('ScheduledGame', ['date', 'home_team', 'away_team', 'home_points', 'away_points'])
+
+
+def get_game_day(date):
+    """Day of a game start time in US/Eastern, which is how the schedules
+    report them. Databases without time zones hand back the Eastern wall
+    clock time as it was stored."""
+    if date.tzinfo is not None:
+        date = date.astimezone(EASTERN)
+    return date.date()
+
+
+class ScheduleChanges(collections.namedtuple('ScheduleChanges', ['inserted', 'changed'])):
+
+    """ScheduledGames inserted into the schedule and existing games whose
+    score was filled in or corrected by `Game.insert_games`"""
+
+    @property
+    def earliest_date(self):
+        """Date of the earliest inserted or changed game, ratings from this
+        date on are out of date"""
+        dates = [game.date.date() for game in self.inserted + self.changed]
+        return min(dates) if dates else None
+
+    @property
+    def stale_probabilities_since(self):
+        """First date whose simulated probabilities are out of date. The
+        probabilities of a date only use the results before it, so a changed
+        result makes the dates after it stale and a new game the dates from
+        its own on. A new game without a date makes every date stale."""
+        if any(game.date is None for game in self.inserted):
+            return datetime.date.min
+        dates = [game.date.date() for game in self.inserted]
+        dates.extend(game.date.date() + datetime.timedelta(days=1) for game in self.changed)
+        return min(dates) if dates else None
+
 
 class Season(db.Model):
     __tablename__ = 'seasons'
@@ -44,53 +134,99 @@ class Game(db.Model):
 
     @classmethod
     def insert_schedule_of_games(cls, year, games):
-        logger.info("Attempting to insert %s games for season=%s", len(games), year)
-        if db.session.query(Season).filter_by(year=year).count() == 0:
-            logger.info("No season for %s. Creating new season", year)
-            season = Season(year=year)
-            db.session.add(season)
-            db.session.commit()
-        else:
-            season = db.session.query(Season).filter_by(year=year).first()
-
-        team_symbols = {game.opponent_symbol: game.opponent for game in list(games.values())[0] + list(games.values())[1]}
-
-        for symbol, team in team_symbols.items():
-            if db.session.query(Team).filter_by(symbol=symbol).count() == 0:
-                logger.info("No existing team found for (%s, %s). Creating new team.", team, symbol)
-                db.session.add(Team(team_name=team, symbol=symbol))
-        db.session.commit()
-
-
-        team_to_id = {team.symbol: team.id for team in db.session.query(Team).all()}
+        """Inserts the games of each team's schedule ({symbol: [scrape.Game]}).
+        Every game is on both teams' schedules, see `insert_games`."""
+        team_names = {game.opponent_symbol: game.opponent for schedule in games.values() for game in schedule}
+        scheduled = []
         for team, game_schedule in games.items():
-            team_id = team_to_id[team]
             for game in game_schedule:
-                opponent_id = team_to_id[game.opponent_symbol]
-                date = game.date
-                home_id = team_id
-                away_id = opponent_id
-                home_points = game.points
-                away_points = game.opponent_points
+                home_team, away_team = team, game.opponent_symbol
+                home_points, away_points = game.points, game.opponent_points
                 if not game.is_home_game:
-                    home_id, away_id = away_id, home_id
+                    home_team, away_team = away_team, home_team
                     home_points, away_points = away_points, home_points
+                scheduled.append(ScheduledGame(game.date, home_team, away_team, home_points, away_points))
+        return cls.insert_games(year, scheduled, team_names)
 
-                inserted_game = db.session.query(cls)\
-                    .filter_by(home_id=home_id, away_id=away_id, date=date).first()
-                if not inserted_game:
-                    logger.info("Inserting new game into database: date=%s, home_id=%s, away_id=%s, home_points=%s, away_points=%s",
-                        date, home_id, away_id, home_points, away_points)
-                    db.session.add(cls(date=date, home_id=home_id, away_id=away_id,
-                        home_points=home_points, away_points=away_points, season=season.id))
+    @classmethod
+    def insert_league_schedule(cls, year, games):
+        """Inserts the games of the league's schedule ([scrape.LeagueGame]),
+        already listed once each from the home team's side"""
+        team_names = {}
+        for game in games:
+            team_names[game.home_team] = game.home_team_name
+            team_names[game.away_team] = game.away_team_name
+        scheduled = [ScheduledGame(game.date, game.home_team, game.away_team, game.home_points, game.away_points)
+            for game in games]
+        return cls.insert_games(year, scheduled, team_names)
 
-                if inserted_game and (inserted_game.home_points is None or inserted_game.away_points is None) and (home_points is not None and away_points is not None):
-                    logger.info("Existing game found without points. Updating points data: %s", inserted_game)
-                    inserted_game.home_points = home_points
-                    inserted_game.away_points = away_points
+    @classmethod
+    def insert_games(cls, year, games, team_names=None):
+        """Inserts new games of a season and fills in or corrects the scores of
+        existing ones, in one transaction -> ScheduleChanges
+
+        `games` are ScheduledGames and may repeat a game, the copy with a score
+        wins. The season's games are fetched once and matched on (home team,
+        away team, day), new games are bulk inserted and scores bulk updated.
+        Teams missing from the database are created, named from `team_names`.
+        """
+        team_names = team_names or {}
+        deduped = {}
+        for game in games:
+            key = (game.home_team, game.away_team, get_game_day(game.date))
+            if key not in deduped or game.home_points is not None:
+                deduped[key] = game
+        logger.info("Attempting to insert %s games (%s unique) for season=%s", len(games), len(deduped), year)
+
+        season = db.session.query(Season).filter_by(year=year).first()
+        if season is None:
+            logger.info("No season for %s. Creating new season", year)
+            season = Season(year=year)
+            db.session.add(season)
 
+        team_to_id = {team.symbol: team.id for team in db.session.query(Team).all()}
+        symbols = {symbol for home_team, away_team, _ in deduped for symbol in (home_team, away_team)}
+        new_teams = [Team(team_name=team_names.get(symbol, symbol), symbol=symbol)
+            for symbol in sorted(symbols - set(team_to_id))]
+        for team in new_teams:
+            logger.info("No existing team found for (%s, %s). Creating new team.", team.team_name, team.symbol)
+        db.session.add_all(new_teams)
+        db.session.flush()
+        team_to_id.update((team.symbol, team.id) for team in new_teams)
+
+        existing = {(home_id, away_id, get_game_day(date)): (game_id, home_points, away_points)
+            for game_id, home_id, away_id, date, home_points, away_points in db.session.query(
+                cls.id, cls.home_id, cls.away_id, cls.date, cls.home_points, cls.away_points).filter_by(season=season.id)}
+
+        inserted = []
+        changed = []
+        updates = []
+        for (home_team, away_team, day), game in sorted(deduped.items(), key=lambda item: item[1].date):
+            match = existing.get((team_to_id[home_team], team_to_id[away_team], day))
+            if match is None:
+                inserted.append(game)
+                continue
+            # a score is filled in once the game is played and can be
+            # corrected afterwards, both change every result after it
+            game_id, home_points, away_points = match
+            if game.home_points is not None and game.away_points is not None and \
+                    (home_points, away_points) != (game.home_points, game.away_points):
+                logger.debug("Updating points of game %s from %s-%s to %s-%s", game_id, home_points, away_points,
+                    game.home_points, game.away_points)
+                changed.append(game)
+                updates.append(dict(id=game_id, home_points=game.home_points, away_points=game.away_points))
+
+        bulk_insert(cls, [dict(date=game.date, home_id=team_to_id[game.home_team], away_id=team_to_id[game.away_team],
+            home_points=game.home_points, away_points=game.away_points, season=season.id) for game in inserted])
+        if updates:
+            db.session.bulk_update_mappings(cls, updates)
         db.session.commit()
 
+        changes = ScheduleChanges(inserted, changed)
+        logger.info("Inserted %s and changed %s games of season=%s, earliest on %s", len(inserted), len(changed),
+            year, changes.earliest_date)
+        return changes
+
     def __repr__(self):
         class_name = self.__class__.__name__
         home_team = self.home_team.symbol
@@ -102,13 +238,43 @@ class Game(db.Model):
 
 
 
+def load_games(season_ids=None, chunk_size=None, completed=False):
+    """Games of the given seasons (all of them by default) in date order as
+    plain (date, home_team, away_team, home_points, away_points, id, season,
+    home_id, away_id) rows with the team symbols and ids, from a single joined
+    SELECT. Rows can be passed to `elo.Game.from_list_of_games`. With
+    `completed` only the games that have a score are read. With a
+    `chunk_size` the rows are streamed from a server-side cursor that many at
+    a time."""
+    home_team = aliased(Team)
+    away_team = aliased(Team)
+    query = db.session.query(Game.date, home_team.symbol.label('home_team'), away_team.symbol.label('away_team'),
+            Game.home_points, Game.away_points, Game.id, Game.season, Game.home_id, Game.away_id)\
+        .join(home_team, home_team.id == Game.home_id)\
+        .join(away_team, away_team.id == Game.away_id)
+    if season_ids is not None:
+        query = query.filter(Game.season.in_(list(season_ids)))
+    if completed:
+        query = query.filter(Game.home_points.isnot(None), Game.away_points.isnot(None))
+    query = query.order_by(Game.date, Game.id)
+    if chunk_size is not None:
+        query = query.yield_per(chunk_size)
+    return query
+
+
 class EloHistory(db.Model):
+    """One row per team per completed game: the rating change the game caused
+    and the rating after it. Rows are appended in the order games are played."""
     __tablename__ = 'elohistory'
+    __table_args__ = (Index('ix_elohistory_season_id_date', 'season_id', 'date'),)
     id = Column(Integer, primary_key=True)
     season_id = Column(Integer, ForeignKey('seasons.id'))
     team_id = Column(Integer, ForeignKey('teams.id'))
+    game_id = Column(Integer, ForeignKey('games.id'))
     date = Column(Date)
     rating_change = Column(Float)
+    rating = Column(Float)
+    won = Column(Boolean)
 
 
 class SimulatedProbabilities(db.Model):
@@ -119,10 +285,68 @@ class SimulatedProbabilities(db.Model):
     playoff = Column(Float)
     top_seed = Column(Float)
     champion = Column(Float)
+    # number of simulated seasons and the largest standard error of the
+    # three probabilities above
+    trials = Column(Integer)
+    standard_error = Column(Float)
 
     team = relationship('Team', foreign_keys='SimulatedProbabilities.team_id')
 
 
+class ProbabilityJob(db.Model):
+    """Progress of generating the probabilities of a (season, date): pending
+    once scheduled to be (re)generated and complete, with the trials and the
+    seconds it took, once its probabilities are saved"""
+    __tablename__ = 'probabilityjobs'
+    PENDING = 'pending'
+    COMPLETE = 'complete'
 
-
-
+    season_id = Column(Integer, ForeignKey('seasons.id'), primary_key=True)
+    date = Column(Date, primary_key=True)
+    status = Column(String(16))
+    trials = Column(Integer)
+    duration = Column(Float)
+    updated_at = Column(DateTime)
+
+
+# columns added to tables that databases created by older versions already
+# have, which `db.create_all` leaves alone
+ADDED_COLUMNS = (
+    (SimulatedProbabilities, ('trials', 'standard_error')),
+    (EloHistory, ('game_id', 'rating', 'won')),
+)
+
+
+def upgrade_schema():
+    """Brings a database created by an older version up to date: creates the
+    missing tables, adds the missing columns and indexes, and drops the elo
+    history rows that predate `EloHistory.game_id`, which the web app then
+    replays and `tasks.update_elo_history` rebuilds. Foreign keys of added
+    columns are not created. -> list of the statements run"""
+    db.create_all()
+    inspector = inspect(db.engine)
+    statements = []
+    for model, names in ADDED_COLUMNS:
+        existing = {column['name'] for column in inspector.get_columns(model.__tablename__)}
+        for name in names:
+            if name not in existing:
+                column = CreateColumn(model.__table__.c[name]).compile(dialect=db.engine.dialect)
+                statements.append('ALTER TABLE %s ADD COLUMN %s' % (model.__tablename__, column))
+    for statement in statements:
+        logger.info("Upgrading schema: %s", statement)
+        db.session.execute(text(statement))
+    db.session.commit()
+
+    for model, _ in ADDED_COLUMNS:
+        indexes = {index['name'] for index in inspector.get_indexes(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if index.name not in indexes:
+                logger.info("Upgrading schema: creating index %s", index.name)
+                index.create(db.engine)
+                statements.append('CREATE INDEX %s' % index.name)
+
+    count = EloHistory.query.filter(EloHistory.game_id.is_(None)).delete(synchronize_session=False)
+    db.session.commit()
+    if count:
+        logger.info("Dropped %s elo history rows without a game, rerun elo_history to rebuild them", count)
+    return statements
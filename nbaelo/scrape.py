@@ -1,18 +1,35 @@
 import collections
+import concurrent.futures
+import datetime
 import logging
+import re
+import threading
 import time
+import urllib.parse
 
 import bs4
+import lxml.html
 import pytz
 import requests
+import requests.adapters
 
 from dateutil.parser import parse
 
+from . import httpcache
+
 logger = logging.getLogger(__name__)
 
+EASTERN = pytz.timezone('US/Eastern')
+# game_start_time as shown on schedules, e.g. "7:30p EST" or "10:30p ET"
+START_TIME = re.compile(r'\s*(\d{1,2}):(\d{2})\s*([ap])')
+
 Game = collections.namedtuple('Game', ['date', 'is_home_game', 'opponent',
     'points', 'opponent_points', 'opponent_symbol'])
 
+# a row of the league's schedule, every game appears once
+LeagueGame = collections.namedtuple('LeagueGame', ['date', 'home_team', 'away_team', 'home_points', 'away_points',
+    'home_team_name', 'away_team_name'])
+
 
 def parse_url(url):
     url_ = url[url.find('teams/'):]
@@ -64,35 +81,280 @@ def get_additional_links(raw_html):
     return links
 
 
+def parse_game_date(date_text, start_time_text):
+    """-> datetime in US/Eastern of a schedule's "Wed, Oct 28, 2015" and
+    "8:00p EST" cells, the way `parse_game` reads them but without dateutil"""
+    try:
+        game_date = datetime.datetime.strptime(date_text, '%a, %b %d, %Y')
+    except ValueError:
+        return parse(date_text + ' ' + start_time_text).replace(tzinfo=EASTERN)
+    match = START_TIME.match(start_time_text)
+    if match:
+        hour, minute, meridiem = int(match.group(1)), int(match.group(2)), match.group(3)
+        hour = hour % 12 + (12 if meridiem == 'p' else 0)
+        game_date = game_date.replace(hour=hour, minute=minute)
+    elif start_time_text.strip():
+        return parse(date_text + ' ' + start_time_text).replace(tzinfo=EASTERN)
+    return game_date.replace(tzinfo=EASTERN)
+
+
+def parse_schedule_page(raw_html):
+    """-> (games, links to the opponents' pages) of a team's schedule, in one
+    pass over the page with lxml. Gives the same games as `parse_schedule`
+    and the same links as `get_additional_links`, without building a
+    BeautifulSoup tree for each."""
+    tree = lxml.html.fromstring(raw_html)
+    games = []
+    links = collections.OrderedDict()
+    for row in tree.xpath('//table[@id="games"]//tr[td]'):
+        raw_data = {td.get('data-stat'): td for td in row.iterchildren('td')}
+        opponent_link = raw_data['opp_name'].find('a').get('href')
+        links[opponent_link] = None
+        points, opponent_points = raw_data['pts'].text_content(), raw_data['opp_pts'].text_content()
+        games.append(Game(
+            date=parse_game_date(raw_data['date_game'].text_content(), raw_data['game_start_time'].text_content()),
+            is_home_game=raw_data['game_location'].text_content().strip() != '@',
+            opponent=raw_data['opp_name'].text_content(),
+            points=int(points) if points else None,
+            opponent_points=int(opponent_points) if opponent_points else None,
+            opponent_symbol=[href for href in row.xpath('.//a/@href') if '/teams/' in href][0].split('/')[2]))
+    logger.info("From raw html parsed out %s games and %s links from schedule", len(games), len(links))
+    return games, list(links)
+
+
+def parse_league_schedule(raw_html):
+    """-> (games, whether the playoffs start on the page) of one month of the
+    league's schedule. Only the games before the playoffs are returned."""
+    tree = lxml.html.fromstring(raw_html)
+    games = []
+    for row in tree.xpath('//table[@id="schedule"]//tr'):
+        raw_data = {cell.get('data-stat'): cell for cell in row.iterchildren('th', 'td')}
+        if not row.xpath('td'):
+            # the playoffs follow a header row of their own
+            if row.text_content().strip() == 'Playoffs':
+                logger.info("From raw html parsed out %s games before the playoffs", len(games))
+                return games, True
+            continue
+        home_points, away_points = raw_data['home_pts'].text_content(), raw_data['visitor_pts'].text_content()
+        start_time = raw_data['game_start_time'].text_content() if 'game_start_time' in raw_data else ''
+        games.append(LeagueGame(
+            date=parse_game_date(raw_data['date_game'].text_content(), start_time),
+            home_team=raw_data['home_team_name'].find('a').get('href').split('/')[2],
+            away_team=raw_data['visitor_team_name'].find('a').get('href').split('/')[2],
+            home_points=int(home_points) if home_points else None,
+            away_points=int(away_points) if away_points else None,
+            home_team_name=raw_data['home_team_name'].text_content(),
+            away_team_name=raw_data['visitor_team_name'].text_content()))
+    logger.info("From raw html parsed out %s games from the league schedule", len(games))
+    return games, False
+
+
+def get_month_links(raw_html):
+    """-> links to each month of the season on a page of the league's schedule"""
+    tree = lxml.html.fromstring(raw_html)
+    links = collections.OrderedDict((link, None) for link in tree.xpath('//a[contains(@href, "_games-")]/@href'))
+    logger.debug("Found (%s) monthly schedules to scrape: %s", len(links), list(links))
+    return list(links)
+
+
+class TokenBucket:
+
+    """Thread safe token bucket: `acquire` blocks until a token is available.
+    Tokens refill at `rate` per second up to `capacity`, so at most
+    `capacity` requests go out back to back and then one every 1 / `rate`
+    seconds."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
 class GameScraper:
 
+    """Fetches every team's schedule of a season, starting from one team and
+    following the links to its opponents.
+
+    The opponents' pages are fetched by a pool of `workers` threads sharing
+    one pooled session, and parsed as they arrive. Each host gets bursts of at
+    most `burst` requests and then one every `seconds_between_requests`, and
+    failed requests (connection errors and 429/5xx responses) are retried up
+    to `retries` times, backing off `backoff`, 2 * `backoff`, ... seconds.
+
+    With an `httpcache.HTTPCache` pages are requested conditionally, and
+    `scrape` leaves out the teams whose schedule did not change since it was
+    last cached (with `refresh` every page is fetched and parsed in full).
+    """
+
     DOMAIN = "http://www.basketball-reference.com"
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
 
-    def __init__(self, seconds_between_requests=1):
+    def __init__(self, seconds_between_requests=1, workers=4, burst=1, retries=3, backoff=1, timeout=30, domain=None,
+            cache=None, refresh=False):
         self.seconds_between_requests = seconds_between_requests
+        self.burst = burst
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.domain = domain or self.DOMAIN
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.cache = cache
+        self.refresh = refresh
+        # urls whose page is the one cached, and pages fetched but not yet cached
+        self.unchanged = set()
+        self.fetched = {}
 
-    def scrape(self, year, seed_team='LAL'):
-        raw_html = self.fetch_schedule(year, seed_team)
-
-        games = parse_schedule(raw_html)
-        teams = {seed_team: games}
+    def scrape(self, year, seed_team='LAL', teams=None):
+        """-> {team symbol: [Game]} of every team of a season, or of only
+        `teams`, whose pages are then fetched without following links"""
+        if teams is not None:
+            return self.scrape_teams(year, teams)
 
-        team_links = get_additional_links(raw_html)
+        games, team_links = parse_schedule_page(self.fetch_schedule(year, seed_team))
 
+        links = {}
         for link in team_links:
-            logger.info("Processing schedule from link: %s", link)
             team, yr = parse_url(link)
             assert yr == year, 'Fetched schedule for %s, but found link for %s' % (year, yr)
-            teams[team] = parse_schedule(self.fetch_schedule(year, team))
+            links[team] = link
+
+        scraped = self.scrape_teams(year, links)
+        if not self.is_unchanged(year, seed_team):
+            scraped[seed_team] = games
+        logger.info("Finished scraping games for %s teams, %s unchanged: %s", len(links) + 1,
+            len(links) + 1 - len(scraped), list(scraped.keys()))
+
+        return scraped
+
+    def scrape_teams(self, year, teams):
+        """-> {team symbol: [Game]} of the given teams whose schedule changed"""
+        scraped = {}
+        with concurrent.futures.ThreadPoolExecutor(max(self.workers, 1)) as executor:
+            futures = {executor.submit(self.fetch_schedule, year, team): team for team in teams}
+            for future in concurrent.futures.as_completed(futures):
+                team = futures[future]
+                raw_html = future.result()
+                if self.is_unchanged(year, team):
+                    continue
+                logger.info("Processing schedule of %s", team)
+                scraped[team], _ = parse_schedule_page(raw_html)
+        return scraped
+
+    def scrape_league(self, year, months=None):
+        """-> LeagueGame of every regular season game of a season, from the
+        league's schedule, a page per month, instead of every team's page.
+        With `months` (e.g. ['november', 'december']) only those are fetched.
 
-            time.sleep(self.seconds_between_requests)
+        Months are fetched like team schedules and parsed in order up to the
+        start of the playoffs; later months only hold playoff games. With a
+        cache, the games of months that did not change are left out."""
+        if months is not None:
+            urls = ['%s/leagues/NBA_%s_games-%s.html' % (self.domain, year, month) for month in months]
+        else:
+            index_url = '%s/leagues/NBA_%s_games.html' % (self.domain, year)
+            logger.info("Fetching league schedule for %s at %s", year, index_url)
+            urls = [self.domain + link for link in get_month_links(self.fetch(index_url))]
 
-        logger.info("Finished scraping games for %s teams: %s", len(teams), list(teams.keys()))
+        with concurrent.futures.ThreadPoolExecutor(max(self.workers, 1)) as executor:
+            pages = list(executor.map(self.fetch, urls))
 
-        return teams
+        games = []
+        for url, raw_html in zip(urls, pages):
+            month_games, playoffs = parse_league_schedule(raw_html)
+            if url not in self.unchanged:
+                games.extend(month_games)
+            if playoffs:
+                break
+        logger.info("Finished scraping %s games from %s monthly schedules", len(games), len(urls))
+        return games
+
+    def get_schedule_url(self, year, team):
+        return '/'.join([self.domain, 'teams', team.upper(), str(year) + '_games.html'])
+
+    def is_unchanged(self, year, team):
+        """Whether the team's schedule is the same as when it was cached"""
+        return self.get_schedule_url(year, team) in self.unchanged
 
     def fetch_schedule(self, year, team):
-        url = '/'.join([self.DOMAIN, 'teams', team.upper(), str(year) + '_games.html'])
+        url = self.get_schedule_url(year, team)
         logger.info("Fetching game schedule for %s-%s at %s", year, team, url)
-        response = requests.get(url)
-        return response.text
+        return self.fetch(url)
+
+    def get_bucket(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.buckets_lock:
+            if host not in self.buckets:
+                rate = 1. / self.seconds_between_requests if self.seconds_between_requests else float('inf')
+                self.buckets[host] = TokenBucket(rate, self.burst)
+            return self.buckets[host]
+
+    def fetch(self, url):
+        """-> body of `url`. With a cache, asks the server for the page only
+        if it changed since it was cached and notes whether it did."""
+        entry = self.cache.get(url) if self.cache is not None and not self.refresh else None
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+
+        response = self.get(url, headers)
+        if response.status_code == 304:
+            logger.debug("%s not modified, using the cached copy", url)
+            self.unchanged.add(url)
+            return self.cache.read_body(url)
+
+        body = response.text
+        if self.cache is not None:
+            # servers without validators still send the same page again
+            if entry is not None and httpcache.get_content_hash(body) == entry.content_hash:
+                self.unchanged.add(url)
+            self.fetched[url] = (body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return body
+
+    def get(self, url, headers):
+        bucket = self.get_bucket(url)
+        for attempt in range(self.retries + 1):
+            if bucket.rate != float('inf'):
+                bucket.acquire()
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Request to %s failed (%s), retrying", url, e)
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+                logger.warning("Request to %s returned %s, retrying", url, response.status_code)
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def save_cache(self):
+        """Stores the pages fetched since the last save. Called once what was
+        scraped is ingested, so a page is only skipped as unchanged after its
+        games made it into the database."""
+        for url, (body, etag, last_modified) in self.fetched.items():
+            self.cache.put(url, body, etag, last_modified)
+        logger.info("Cached %s fetched pages", len(self.fetched))
+        self.fetched = {}
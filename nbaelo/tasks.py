@@ -1,8 +1,14 @@
 from datetime import timedelta, datetime, date
+import collections
 import math
 import logging
+import time
 
-from . import models, elo, db
+from flask import current_app
+from sqlalchemy import func
+
+from config import Config
+from . import models, elo, cache, db
 
 
 logger = logging.getLogger(__name__)
@@ -27,75 +33,362 @@ def uncomplete_games(games, after_date):
     logger.info("Set %s games to be incomplete by setting home_points=away_points=None after %s", count, after_date)
 
 
-def generate_daily_probabilities(date, trials=1000):
-    season_year = get_season_year_from_date(date)
+def load_season_games(season_year):
+    """-> (season_id, elo games) of a season from the database"""
     season_id = models.Season.query.filter_by(year=season_year).first().id
+    logger.info("Found season_year=%s with primary_key=%s", season_year, season_id)
 
-    logger.info("Given date %s, found season_year=%s with primary_key=%s", date, season_year, season_id)
-
-    games = models.Game.query.filter_by(season=season_id).all()
+    games = models.load_games([season_id]).all()
     logger.info("Retrieved %s games for season=%s", len(games), season_year)
-    gs = elo.Game.from_list_of_games(games)
+    return season_id, elo.Game.from_list_of_games(games)
+
+
+def get_pending_games(season_year, now=None):
+    """-> (date, home_team, away_team) of the games of a season that started
+    before `now` (the current Eastern time) and still have no score, in date
+    order. None if the season has no games yet."""
+    season = models.Season.query.filter_by(year=season_year).first()
+    if season is None or not models.Game.query.filter_by(season=season.id).count():
+        return None
+    now = now or datetime.now(models.EASTERN)
+    if db.engine.dialect.name == 'sqlite' and now.tzinfo is not None:
+        # sqlite drops the time zone and stores the Eastern wall clock time,
+        # time zone aware databases compare the actual instants
+        now = now.astimezone(models.EASTERN).replace(tzinfo=None)
+    pending = models.load_games([season.id])\
+        .filter(models.Game.home_points.is_(None), models.Game.date <= now).all()
+    logger.info("Found %s games of season=%s waiting on a result", len(pending), season_year)
+    return [(g.date, g.home_team, g.away_team) for g in pending]
+
+
+def get_season_version(season_id):
+    """-> [games, highest game id, completed games, home points, away points]
+    of a season from one aggregate query. It changes whenever a game of the
+    season is inserted, deleted or scored, which is what the season cache is
+    checked against."""
+    row = db.session.query(func.count(models.Game.id), func.max(models.Game.id),
+            func.count(models.Game.home_points), func.sum(models.Game.home_points),
+            func.sum(models.Game.away_points))\
+        .filter(models.Game.season == season_id).one()
+    return [0 if value is None else int(value) for value in row]
+
 
-    uncomplete_games(gs, date)
+def _write_season_cache(directory, season_year, season_id, version, gs):
+    cache.write_season(directory, season_year, season_id,
+        [(g.game_id, g.date, g.home_team, g.away_team, g.home_points, g.away_points) for g in gs], version)
+
+
+def write_season_cache(season_year):
+    """Writes the games of a season to the season cache, if there is one"""
+    directory = current_app.config.get('SEASON_CACHE_DIR')
+    if not directory:
+        return
+    season_id = models.Season.query.filter_by(year=season_year).first().id
+    version = get_season_version(season_id)
+    _, gs = load_season_games(season_year)
+    _write_season_cache(directory, season_year, season_id, version, gs)
+
+
+def load_season(season_year):
+    """-> (season_id, elo games, elo teams) for a season, mapped from the
+    season cache when it has the season and from the database otherwise.
+    The cache is only used while the season id and `get_season_version`
+    still match the database, it is rewritten when they do not. Teams start
+    from the ratings carried over from the season before (see
+    `get_start_ratings`)."""
+    directory = current_app.config.get('SEASON_CACHE_DIR')
+    cached = cache.load_season(directory, season_year) if directory else None
+    season = models.Season.query.filter_by(year=season_year).first() if directory else None
+    version = get_season_version(season.id) if season is not None else None
+    if cached is not None and (season is None or season.id != cached.season_id or version != cached.version):
+        logger.warning("Season cache of season=%s (%s) no longer matches the database, rebuilding it",
+            season_year, cached.content_hash)
+        cached = None
+
+    if cached is not None:
+        logger.info("Loaded %s games of season=%s from the season cache (%s)", len(cached), season_year,
+            cached.content_hash)
+        season_id, gs = cached.season_id, cached.to_games()
+    else:
+        season_id, gs = load_season_games(season_year)
+        if directory:
+            _write_season_cache(directory, season_year, season_id, version, gs)
 
     day_before_first_day_of_season = (min(g.date for g in gs) - timedelta(1)).date()
     logger.info("Day before first day of season for season=%s determined to be %s",
         season_year, day_before_first_day_of_season)
     teams = elo.Team.generate_teams_from_season_of_games(gs, day_before_first_day_of_season)
+    start_ratings = get_start_ratings(season_year)
+    if start_ratings:
+        team_ids = {team.symbol: team.id for team in models.Team.query.all()}
+        for team in teams:
+            team.start_rating = start_ratings.get(team_ids.get(team.symbol), team.start_rating)
+    return season_id, gs, teams
+
+
+def get_start_ratings(season_year):
+    """-> {team_id: rating} each team carries into a season from the stored
+    history of the season before, the same way `elo.RatingEngine` does.
+    Teams missing from it start at 1500."""
+    carryover = Config.ELO_CARRYOVER
+    previous_season = models.Season.query.filter(models.Season.year < season_year)\
+        .order_by(models.Season.year.desc()).first()
+    if not carryover or previous_season is None:
+        return {}
+
+    final_ratings = {}
+    for team_id, rating in db.session.query(models.EloHistory.team_id, models.EloHistory.rating)\
+            .filter(models.EloHistory.season_id == previous_season.id)\
+            .order_by(models.EloHistory.date, models.EloHistory.id):
+        final_ratings[team_id] = rating
+    return {team_id: elo.regress_rating(rating, carryover) for team_id, rating in final_ratings.items()}
+
+
+def iter_completed_games(season_ids=None, chunk_size=10000):
+    """Streams the completed games of `models.load_games` as the (game_id,
+    season_id, date, home_id, away_id, home_points, away_points) tuples
+    `elo.RatingEngine` and `elo.ParameterSweep` replay"""
+    for g in models.load_games(season_ids, chunk_size, completed=True):
+        yield g.id, g.season, g.date, g.home_id, g.away_id, g.home_points, g.away_points
+
+
+def rate_all_seasons(chunk_size=10000):
+    """Rebuilds the elo history of every stored season with one pass over the
+    games table: completed games are streamed in date order `chunk_size` at a
+    time, rated by an `elo.RatingEngine` and bulk inserted a chunk at a time.
+    Ratings carry over between seasons by `Config.ELO_CARRYOVER`, the same as
+    everywhere else, so `update_elo_history` rebuilds the same history.
+    -> number of games rated"""
+    models.EloHistory.query.delete(synchronize_session=False)
+
+    engine = elo.RatingEngine(carryover=Config.ELO_CARRYOVER)
+    rows = []
+    count = 0
+    for game in engine.rate(iter_completed_games(chunk_size=chunk_size)):
+        date = game.date.date()
+        rows.append(dict(season_id=game.season, team_id=game.home_team, game_id=game.game_id, date=date,
+            rating_change=game.home_change, rating=game.home_rating, won=game.home_won))
+        rows.append(dict(season_id=game.season, team_id=game.away_team, game_id=game.game_id, date=date,
+            rating_change=-game.home_change, rating=game.away_rating, won=not game.home_won))
+        count += 1
+        if len(rows) >= 2 * chunk_size:
+            db.session.bulk_insert_mappings(models.EloHistory, rows)
+            rows = []
+            logger.info("Rated %s games through %s", count, date)
+    db.session.bulk_insert_mappings(models.EloHistory, rows)
+    db.session.commit()
+    logger.info("Rated %s games of every season with carryover=%s", count, engine.carryover)
+    return count
+
+
+def calibrate(grid, season_years=None, chunk_size=10000):
+    """Scores every combination of rating parameters in `grid` (see
+    `elo.ParameterSweep`) over the given seasons, all of them by default.
+    -> the sweep"""
+    sweep = elo.ParameterSweep(grid)
+    logger.info("Replaying games under %s parameter combinations", len(sweep.parameters))
+    season_ids = None
+    if season_years is not None:
+        season_ids = [season.id for season in models.Season.query.filter(models.Season.year.in_(list(season_years)))]
+    sweep.add(iter_completed_games(season_ids, chunk_size))
+    logger.info("Scored %s games; best parameters %s", sweep.games, sweep.best_parameters)
+    return sweep
+
+
+def update_elo_history(season_year, since=None):
+    """Brings the stored rating history of a season up to date.
+
+    Games already in the history are replayed from their stored rating
+    changes and only the games completed since go through
+    `Season.update_ratings`. If the history no longer lines up with the
+    completed games (a result was added before the last rated game or a rated
+    game lost its score), or `since` is given because a result on or after
+    that date changed, the history is thrown away from that date on and
+    rebuilt. -> number of games rated
+    """
+    season_id, gs, teams = load_season(season_year)
+    team_ids = {team.symbol: team.id for team in models.Team.query.all()}
 
-    logger.info("Loading data complete; beginning season simulations...")
-    simulator = elo.Simulator(season_year, teams, gs)
-    simulator.simulate_many_seasons(trials)
+    history = db.session.query(models.EloHistory.game_id, models.EloHistory.team_id, models.EloHistory.date,
+            models.EloHistory.rating_change)\
+        .filter(models.EloHistory.season_id == season_id)\
+        .order_by(models.EloHistory.date, models.EloHistory.id).all()
+
+    completed = {game.game_id: game for game in gs if game.is_complete}
+    rated = {row.game_id for row in history}
+    rebuild_dates = [row.date for row in history if row.game_id not in completed]
+    unrated = [game.date.date() for game in completed.values() if game.game_id not in rated]
+    if unrated and history and min(unrated) < history[-1].date:
+        rebuild_dates.append(min(unrated))
+    if since is not None:
+        rebuild_dates.append(since)
+
+    if rebuild_dates:
+        rebuild_date = min(rebuild_dates)
+        logger.info("Rebuilding elo history of season=%s from %s", season_year, rebuild_date)
+        models.EloHistory.query\
+            .filter(models.EloHistory.season_id == season_id)\
+            .filter(models.EloHistory.date >= rebuild_date)\
+            .delete(synchronize_session=False)
+        history = [row for row in history if row.date < rebuild_date]
+
+    changes = {(row.game_id, row.team_id): row.rating_change for row in history}
+    season = elo.Season(season_year, teams, gs)
+    count = 0
+    for game in season:
+        if not game.is_complete:
+            continue
+        home_change = changes.get((game.game_id, team_ids[game.home_team]))
+        if home_change is not None:
+            season.apply_rating_change(game, home_change)
+            continue
+
+        home_change = season.update_ratings(game)
+        for symbol, change in ((game.home_team, home_change), (game.away_team, -home_change)):
+            db.session.add(models.EloHistory(season_id=season_id, team_id=team_ids[symbol],
+                game_id=game.game_id, date=game.date.date(), rating_change=change,
+                rating=season.teams[symbol].current_rating, won=symbol == game.winner))
+        count += 1
+    db.session.commit()
+    logger.info("Rated %s new games of season=%s (%s already in the elo history)", count, season_year,
+        len(history) // 2)
+    return count
+
+
+def simulate_probabilities(snapshot, trials=1000, workers=1, seed=None, tolerance=None, max_trials=100000):
+    """Simulates the rest of the season from a snapshot -> {team: probabilities}
+
+    Without a `tolerance` exactly `trials` seasons are simulated. With one,
+    seasons are simulated `trials` at a time until every probability has a
+    standard error within `tolerance` or `max_trials` is reached.
+    """
+    simulator = elo.Simulator.from_snapshot(snapshot, workers=workers, seed=seed)
+    if tolerance is None:
+        simulator.simulate_many_seasons(trials)
+    else:
+        simulator.simulate_until_precise(tolerance, max_trials, batch_trials=trials)
 
     outcomes = (simulator.playoff_probabilities, simulator.top_seed_probabilities, simulator.get_championship_probabilities())
+    standard_errors = simulator.standard_errors
+    logger.info("Simulated %s seasons with a standard error of at most %.4f", simulator.trials,
+        simulator.max_standard_error)
 
     data = {}
     for team in outcomes[0].keys():
         data[team] = dict(playoff=outcomes[0][team], top_seed=outcomes[1][team],
-            champion=outcomes[2][team])
-
-    logger.info("Completed simulation for %s. Inserting data into database.", date)
-    for team, probabilities in data.items():
-        team_id = models.Team.query.filter_by(symbol=team).first().id
-        logger.debug("Trying to insert probabilities for %s(team_id=%s, season_id=%s, date=%s)",
-            team, team_id, season_id, date)
-
-        preexisting = models.SimulatedProbabilities.query.filter_by(season_id=season_id, team_id=team_id, date=date).first()
-        if preexisting is not None:
-            logger.debug("Found existing entry for %s(team_id=%s) %s(season_id=%s) on %s. Proceeding to delete row.",
-                team, team_id, season_year, season_id, date)
-            db.session.delete(preexisting)
-            db.session.commit()
-
-        simulated_probalities = models.SimulatedProbabilities(season_id=season_id,
-            team_id=team_id, date=date, playoff=probabilities['playoff'],
-            top_seed=probabilities['top_seed'], champion=probabilities['champion'])
-        db.session.add(simulated_probalities)
-        db.session.commit()
+            champion=outcomes[2][team], trials=simulator.trials,
+            standard_error=max(standard_errors[team].values()))
+    return data
+
+
+def save_probabilities(season_id, results, durations=None):
+    """Replaces the probabilities of every date in `results` ({date: {team:
+    probabilities}}) in a single transaction: one bulk delete of the dates
+    followed by one bulk insert (see `models.bulk_insert`). The jobs of the
+    dates are marked complete in the same transaction, along with the
+    seconds each took from `durations`."""
+    team_ids = {team.symbol: team.id for team in models.Team.query.all()}
+    rows = [dict(season_id=season_id, team_id=team_ids[team], date=date, playoff=probabilities['playoff'],
+                top_seed=probabilities['top_seed'], champion=probabilities['champion'],
+                trials=probabilities['trials'], standard_error=probabilities['standard_error'])
+        for date, data in results.items() for team, probabilities in data.items()]
+    now = datetime.utcnow()
+    durations = durations or {}
+    jobs = [dict(season_id=season_id, date=date, status=models.ProbabilityJob.COMPLETE,
+            trials=max(probabilities['trials'] for probabilities in data.values()),
+            duration=durations.get(date), updated_at=now)
+        for date, data in results.items()]
+
+    for model in (models.SimulatedProbabilities, models.ProbabilityJob):
+        model.query\
+            .filter(model.season_id == season_id)\
+            .filter(model.date.in_(list(results.keys())))\
+            .delete(synchronize_session=False)
+    models.bulk_insert(models.SimulatedProbabilities, rows)
+    models.bulk_insert(models.ProbabilityJob, jobs)
+    db.session.commit()
+    logger.info("Saved probabilities for %s dates of season_id=%s", len(results), season_id)
+
+
+def get_completed_dates(season_id):
+    """-> set of the dates of a season whose probabilities are complete: the
+    dates with a complete job, and the dates generated before jobs were
+    tracked, which have probabilities but no job at all"""
+    jobs = dict(db.session.query(models.ProbabilityJob.date, models.ProbabilityJob.status)
+        .filter(models.ProbabilityJob.season_id == season_id))
+    generated = {dt for dt, in db.session.query(models.SimulatedProbabilities.date).distinct()
+        .filter(models.SimulatedProbabilities.season_id == season_id)}
+    return {dt for dt, status in jobs.items() if status == models.ProbabilityJob.COMPLETE} | \
+        {dt for dt in generated if dt not in jobs}
+
+
+def reset_jobs(season_id, dates):
+    """Marks the dates of a season pending so they are generated again, even
+    if an interrupted run leaves their old probabilities in place"""
+    now = datetime.utcnow()
+    models.ProbabilityJob.query\
+        .filter(models.ProbabilityJob.season_id == season_id)\
+        .filter(models.ProbabilityJob.date.in_(list(dates)))\
+        .delete(synchronize_session=False)
+    models.bulk_insert(models.ProbabilityJob, [dict(season_id=season_id, date=date,
+        status=models.ProbabilityJob.PENDING, updated_at=now) for date in dates])
+    db.session.commit()
+    logger.info("Reset %s jobs of season_id=%s to pending", len(dates), season_id)
+
+
+JobStatus = collections.namedtuple('JobStatus', ['total', 'complete', 'trials', 'duration', 'rate', 'eta'])
+
+
+def get_job_status(season_id, dates, window=timedelta(hours=1)):
+    """-> JobStatus of the given dates of a season: how many are complete with
+    how many trials and seconds of simulating, the dates completed per second
+    over the last `window` and the time left at that rate"""
+    dates = set(dates)
+    jobs = db.session.query(models.ProbabilityJob.date, models.ProbabilityJob.trials,
+            models.ProbabilityJob.duration, models.ProbabilityJob.updated_at)\
+        .filter(models.ProbabilityJob.season_id == season_id)\
+        .filter(models.ProbabilityJob.status == models.ProbabilityJob.COMPLETE).all()
+    jobs = [job for job in jobs if job.date in dates]
+
+    now = datetime.utcnow()
+    recent = [job.updated_at for job in jobs if job.updated_at is not None and now - job.updated_at <= window]
+    rate = len(recent) / max((now - min(recent)).total_seconds(), 1) if recent else 0.
+    remaining = len(dates) - len(jobs)
+    eta = timedelta(seconds=round(remaining / rate)) if rate else None
+    return JobStatus(len(dates), len(jobs), sum(job.trials or 0 for job in jobs),
+        sum(job.duration or 0 for job in jobs), rate, eta)
+
+
+def generate_season_probabilities(season_year, dates, trials=1000, workers=1, seed=None, tolerance=None,
+        max_trials=100000, write_batch=10):
+    """Generates the probabilities as of each of `dates` with a single pass
+    over the season: the games are loaded and replayed once and each date is
+    simulated from the snapshot of the season at the start of that date.
+    Results are saved `write_batch` dates at a time, so an interrupted run
+    keeps the dates it already wrote."""
+    season_id, gs, teams = load_season(season_year)
+
+    logger.info("Loading data complete; beginning season simulations for %s dates...", len(dates))
+    results = {}
+    durations = {}
+    for date, snapshot in elo.iter_daily_snapshots(season_year, teams, gs, dates):
+        logger.info("Generating team probabilities as of %s", date)
+        # each date gets its own reproducible stream when seeded
+        date_seed = None if seed is None else [seed, date.toordinal()]
+        started = time.time()
+        results[date] = simulate_probabilities(snapshot, trials, workers, date_seed, tolerance, max_trials)
+        durations[date] = time.time() - started
+        if len(results) >= write_batch:
+            save_probabilities(season_id, results, durations)
+            results, durations = {}, {}
+
+    if results:
+        save_probabilities(season_id, results, durations)
+    logger.info("Completed simulations for %s dates of season %s", len(dates), season_year)
+
+
+def generate_daily_probabilities(date, trials=1000, workers=1, seed=None, tolerance=None, max_trials=100000):
+    generate_season_probabilities(get_season_year_from_date(date), [date], trials, workers, seed, tolerance,
+        max_trials)
     logger.info("Completed generating probabilities for all teams for %s", date)
 
-# def generate_elo_history(year):
-#     season_id = models.Season.query.filter_by(year=year).first().id
-
-#     games = models.Game.query.filter_by(season=season_id).all()
-#     day_before_first_day_of_season = min(g.date for g in games) - timedelta(1)
-#     gs = elo.Game.from_list_of_games(games)
-#     teams = elo.Team.generate_teams_from_season_of_games(gs, day_before_first_day_of_season)
-
-#     season = elo.Season(year, teams, gs)
-#     season.play_through_season()
-
-#     total_change = 0
-#     for symbol, team in season.teams.items():
-#         team_id = models.Team.query.filter_by(symbol=symbol).first().id
-#         preexisting_changes = models.EloHistory.query.filter_by(season_id=season_id, team_id=team_id)
-#         preexisting_changes.delete()
-#         for dt, change in team.rating_changes.items():
-#             if change == 0:
-#                 continue
-#             elo_change = models.EloHistory(season_id=season_id, team_id=team_id, date=dt, rating_change=change)
-#             db.session.add(elo_change)
-#             total_change += change
-#     assert math.isclose(0, total_change, abs_tol=0.00001)
-#     db.session.commit()
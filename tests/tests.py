@@ -1,8 +1,19 @@
+import collections
+import contextlib
+import http.server
+import io
 import os
 import sys
 import unittest
 from unittest import mock
 import datetime
+import itertools
+import math
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
 
 basedir = os.path.dirname(__file__)
 sys.path.append(os.path.dirname(basedir))
@@ -10,10 +21,13 @@ sys.path.append(os.path.dirname(basedir))
 import pytz
 import bs4
 import requests
+import numpy
+import sqlalchemy
 
 from flask_testing import TestCase
 
-from nbaelo import scrape, create_app
+from config import Config, TestingConfig, config
+from nbaelo import httpcache, ingest, scrape, elo, models, tasks, backfill, cache, db, create_app
 
 from manage import app
 
@@ -98,17 +112,17 @@ class TestScraping(unittest.TestCase):
         self.assertEqual(len([g for g in games if g.is_home_game]), 41)
         self.assertEqual(len([g for g in games if g.points > g.opponent_points]), 57)
 
-    @mock.patch('nbaelo.scrape.requests')
-    def test_fetch_schedule_called_with_correct_url(self, mock_requests):
-        self.scraper.fetch_schedule(2016, 'CLE')
-        mock_requests.get.assert_called_with("http://www.basketball-reference.com/teams/CLE/2016_games.html")
+    def test_fetch_schedule_called_with_correct_url(self):
+        with mock.patch.object(self.scraper, 'session') as mock_session:
+            mock_session.get.return_value.status_code = 200
+            self.scraper.fetch_schedule(2016, 'CLE')
+        mock_session.get.assert_called_with("http://www.basketball-reference.com/teams/CLE/2016_games.html",
+            headers={}, timeout=self.scraper.timeout)
 
-    @mock.patch('nbaelo.scrape.parse_schedule')
-    @mock.patch('nbaelo.scrape.get_additional_links')
+    @mock.patch('nbaelo.scrape.parse_schedule_page')
     @mock.patch.object(scrape.GameScraper, 'fetch_schedule')
-    def test_scrape_crawls_all_links(self,  mock_fetch_schedule, mock_get_additional_links,
-        mock_parse_schedule):
-        mock_get_additional_links.return_value = ['/teams/ATL/2016.html', '/teams/GSW/2016.html']
+    def test_scrape_crawls_all_links(self,  mock_fetch_schedule, mock_parse_schedule_page):
+        mock_parse_schedule_page.return_value = ([], ['/teams/ATL/2016.html', '/teams/GSW/2016.html'])
 
         teams = self.scraper.scrape(2016, 'LAL')
 
@@ -118,10 +132,1158 @@ class TestScraping(unittest.TestCase):
             mock.call(2016, 'GSW')
         ]
 
-        mock_fetch_schedule.assert_has_calls(expected_calls, any_order=False)
+        # the seed team comes first, the rest are fetched concurrently
+        self.assertEqual(mock_fetch_schedule.call_args_list[0], expected_calls[0])
+        mock_fetch_schedule.assert_has_calls(expected_calls, any_order=True)
 
         self.assertEqual(set(teams.keys()), set(['GSW', 'LAL', 'ATL']))
 
+    def test_parse_schedule_page_matches_soup_parser(self):
+        games, links = scrape.parse_schedule_page(self.html)
+
+        self.assertEqual(games, scrape.parse_schedule(self.html))
+        self.assertEqual(sorted(links), sorted(scrape.get_additional_links(self.html)))
+        self.assertEqual([g.date.tzinfo for g in games], [pytz.timezone('US/Eastern')] * 82)
+
+    def test_parse_game_date(self):
+        eastern = pytz.timezone('US/Eastern')
+        self.assertEqual(scrape.parse_game_date('Wed, Oct 28, 2015', '8:00p EST'),
+            datetime.datetime(2015, 10, 28, 20, 0, tzinfo=eastern))
+        self.assertEqual(scrape.parse_game_date('Sun, Dec 25, 2016', '12:00p ET'),
+            datetime.datetime(2016, 12, 25, 12, 0, tzinfo=eastern))
+        self.assertEqual(scrape.parse_game_date('Sun, Dec 25, 2016', '12:30a'),
+            datetime.datetime(2016, 12, 25, 0, 30, tzinfo=eastern))
+        # no start time on record, and formats only dateutil understands
+        self.assertEqual(scrape.parse_game_date('Sun, Dec 25, 2016', ''),
+            datetime.datetime(2016, 12, 25, tzinfo=eastern))
+        self.assertEqual(scrape.parse_game_date('2016-12-25', '19:30'),
+            datetime.datetime(2016, 12, 25, 19, 30, tzinfo=eastern))
+
+
+class ScheduleRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    """Serves the Cavs fixture as every team's schedule and the league's
+    monthly fixtures, or the body in
+    `bodies` for its path. Paths in `failures` answer 503 that many times
+    first. With an `etag`, pages are tagged with it and not sent again to
+    requests that already have it."""
+
+    failures = collections.Counter()
+    requests = collections.Counter()
+    not_modified = collections.Counter()
+    bodies = {}
+    etag = None
+
+    def do_GET(self):
+        self.requests[self.path] += 1
+        if self.failures[self.path] > 0:
+            self.failures[self.path] -= 1
+            self.send_error(503)
+            return
+        if self.etag is not None and self.headers.get('If-None-Match') == self.etag:
+            self.not_modified[self.path] += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        if self.path in self.bodies:
+            body = self.bodies[self.path].encode()
+        else:
+            with open(self.get_fixture(self.path), 'rb') as f:
+                body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        if self.etag is not None:
+            self.send_header('ETag', self.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def get_fixture(self, path):
+        if path.startswith('/leagues/'):
+            # the season's page shows its first month
+            filename = os.path.basename(path).lower().replace('_games.html', '_games-october.html')
+            return os.path.join(basedir, filename)
+        return os.path.join(basedir, 'cle_2016_schedule.html')
+
+    def log_message(self, *args):
+        pass
+
+
+class ScheduleServerTestCase(unittest.TestCase):
+
+    """Runs a ScheduleRequestHandler on a free local port"""
+
+    def setUp(self):
+        ScheduleRequestHandler.failures.clear()
+        ScheduleRequestHandler.requests.clear()
+        ScheduleRequestHandler.not_modified.clear()
+        ScheduleRequestHandler.bodies = {}
+        ScheduleRequestHandler.etag = None
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), ScheduleRequestHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.domain = 'http://127.0.0.1:%s' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestConcurrentScraping(ScheduleServerTestCase):
+
+    def test_scrape_every_team_from_local_server(self):
+        ScheduleRequestHandler.failures['/teams/GSW/2016_games.html'] = 2
+        scraper = scrape.GameScraper(seconds_between_requests=0, workers=4, backoff=0, domain=self.domain)
+        teams = scraper.scrape(2016, 'CLE')
+
+        self.assertEqual(len(teams), 30)
+        self.assertTrue(all(len(games) == 82 for games in teams.values()))
+        # the failing page was retried until it came through
+        self.assertEqual(ScheduleRequestHandler.requests['/teams/GSW/2016_games.html'], 3)
+
+    def test_scrape_only_given_teams(self):
+        scraper = scrape.GameScraper(seconds_between_requests=0, domain=self.domain)
+        teams = scraper.scrape(2016, teams=['GSW', 'NYK'])
+
+        self.assertEqual(sorted(teams), ['GSW', 'NYK'])
+        self.assertEqual(set(ScheduleRequestHandler.requests), {'/teams/GSW/2016_games.html',
+            '/teams/NYK/2016_games.html'})
+
+    def test_gives_up_after_retries(self):
+        ScheduleRequestHandler.failures['/teams/CLE/2016_games.html'] = 5
+        scraper = scrape.GameScraper(seconds_between_requests=0, retries=2, backoff=0, domain=self.domain)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            scraper.fetch_schedule(2016, 'CLE')
+        self.assertEqual(ScheduleRequestHandler.requests['/teams/CLE/2016_games.html'], 3)
+
+    def test_requests_are_rate_limited_per_host(self):
+        scraper = scrape.GameScraper(seconds_between_requests=.05, workers=4, burst=2, domain=self.domain)
+        started = time.time()
+        for team in ('CLE', 'GSW', 'ATL', 'BOS', 'MIA', 'LAL'):
+            scraper.fetch_schedule(2016, team)
+        # two go out at once, the other four wait for a token each
+        self.assertGreaterEqual(time.time() - started, 4 * .05 * .9)
+
+
+class TestLeagueScraping(ScheduleServerTestCase):
+
+    def cavs_schedule(self):
+        """-> the Cavs' games read from their own schedule, as ScheduledGames"""
+        with open(os.path.join(basedir, 'cle_2016_schedule.html')) as f:
+            games, _ = scrape.parse_schedule_page(f.read())
+        return [models.ScheduledGame(g.date, 'CLE', g.opponent_symbol, g.points, g.opponent_points) if g.is_home_game
+            else models.ScheduledGame(g.date, g.opponent_symbol, 'CLE', g.opponent_points, g.points) for g in games]
+
+    def test_parse_league_schedule(self):
+        with open(os.path.join(basedir, 'nba_2016_games-october.html')) as f:
+            raw_html = f.read()
+        games, playoffs = scrape.parse_league_schedule(raw_html)
+
+        self.assertFalse(playoffs)
+        self.assertEqual(games[0], scrape.LeagueGame(
+            datetime.datetime(2015, 10, 27, 20, tzinfo=pytz.timezone('US/Eastern')), 'CHI', 'CLE', 97, 95,
+            'Chicago Bulls', 'Cleveland Cavaliers'))
+        self.assertEqual(len(scrape.get_month_links(raw_html)), 9)
+
+    def test_playoffs_are_left_out(self):
+        with open(os.path.join(basedir, 'nba_2016_games-april.html')) as f:
+            games, playoffs = scrape.parse_league_schedule(f.read())
+        self.assertTrue(playoffs)
+        self.assertEqual(len(games), 7)
+        self.assertEqual(max(g.date for g in games).date(), datetime.date(2016, 4, 13))
+
+    def test_scrape_league_matches_team_schedules(self):
+        scraper = scrape.GameScraper(seconds_between_requests=0, domain=self.domain)
+        games = scraper.scrape_league(2016)
+
+        self.assertEqual([models.ScheduledGame(*g[:5]) for g in games], self.cavs_schedule())
+        # the season's page and a page per month, instead of a page per team
+        self.assertEqual(sum(ScheduleRequestHandler.requests.values()), 10)
+
+    def test_scrape_only_given_months(self):
+        scraper = scrape.GameScraper(seconds_between_requests=0, domain=self.domain)
+        games = scraper.scrape_league(2016, ['march', 'april', 'may'])
+
+        self.assertEqual(len(games), 16 + 7)
+        self.assertEqual(set(ScheduleRequestHandler.requests), {'/leagues/NBA_2016_games-march.html',
+            '/leagues/NBA_2016_games-april.html', '/leagues/NBA_2016_games-may.html'})
+
+
+class TestHTTPCache(ScheduleServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.cache = httpcache.HTTPCache(self.directory)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def scrape(self, **kwargs):
+        scraper = scrape.GameScraper(seconds_between_requests=0, domain=self.domain, cache=self.cache, **kwargs)
+        teams = scraper.scrape(2016, 'CLE')
+        scraper.save_cache()
+        return teams
+
+    def test_put_and_get(self):
+        entry = self.cache.put('http://example.com/a', 'body', etag='"x"')
+        self.assertEqual(self.cache.get('http://example.com/a'), entry)
+        self.assertEqual(entry.etag, '"x"')
+        self.assertEqual(self.cache.read_body('http://example.com/a'), 'body')
+        self.assertIsNone(self.cache.get('http://example.com/b'))
+
+    def test_not_modified_pages_are_skipped(self):
+        ScheduleRequestHandler.etag = '"v1"'
+        self.assertEqual(len(self.scrape()), 30)
+        self.assertEqual(sum(ScheduleRequestHandler.not_modified.values()), 0)
+
+        self.assertEqual(self.scrape(), {})
+        self.assertEqual(sum(ScheduleRequestHandler.not_modified.values()), 30)
+
+    def test_only_changed_pages_are_parsed(self):
+        # no validators, the content hash tells the pages apart
+        self.scrape()
+        with open(os.path.join(basedir, 'cle_2016_schedule.html')) as f:
+            ScheduleRequestHandler.bodies['/teams/GSW/2016_games.html'] = f.read().replace('>106<', '>107<')
+
+        teams = self.scrape()
+        self.assertEqual(list(teams), ['GSW'])
+        self.assertEqual(len(teams['GSW']), 82)
+
+    def test_refresh_parses_every_page(self):
+        ScheduleRequestHandler.etag = '"v1"'
+        self.scrape()
+        self.assertEqual(len(self.scrape(refresh=True)), 30)
+        self.assertEqual(sum(ScheduleRequestHandler.not_modified.values()), 0)
+
+    def test_pages_not_saved_are_not_skipped(self):
+        scraper = scrape.GameScraper(seconds_between_requests=0, domain=self.domain, cache=self.cache)
+        scraper.scrape(2016, 'CLE')
+        # the games never made it into the database
+        self.assertEqual(len(self.scrape()), 30)
+
+
+def make_league(teams_per_conference=9, played_through=datetime.datetime(2015, 10, 20)):
+    """Two conferences where every team hosts the teams of its own conference
+    twice and the teams of the other conference once. Games before
+    `played_through` are complete and won by the lower numbered team."""
+    symbols = [conference[0] + str(i) for conference in (elo.WESTERN_CONFERENCE, elo.EASTERN_CONFERENCE)
+        for i in range(teams_per_conference)]
+    start_date = datetime.datetime(2015, 10, 1)
+    teams = [elo.Team(symbol, start_date, elo.WESTERN_CONFERENCE if symbol[0] == 'W' else elo.EASTERN_CONFERENCE)
+        for symbol in symbols]
+
+    matchups = [(home, away) for home, away in itertools.permutations(symbols, 2) if home[0] == away[0]]
+    matchups.extend(itertools.permutations(symbols, 2))
+
+    games = []
+    for i, (home, away) in enumerate(matchups):
+        date = start_date + datetime.timedelta(days=1 + i // 9)
+        if date < played_through:
+            home_won = int(home[1:]) < int(away[1:])
+            games.append(elo.Game(home, away, date, 100 if home_won else 90, 90 if home_won else 100))
+        else:
+            games.append(elo.Game(home, away, date))
+    return teams, games
+
+
+class TestSimulator(unittest.TestCase):
+
+    def setUp(self):
+        teams, games = make_league()
+        self.simulator = elo.Simulator(2016, teams, games, seed=42)
+        self.simulator.simulate_many_seasons(2000)
+
+    def test_win_totals_cover_every_game(self):
+        histogram = self.simulator.win_total_histogram
+        self.assertEqual(histogram.counts.shape, (18, 51))
+        self.assertTrue((histogram.counts.sum(axis=1) == 2000).all())
+        # each of the 450 games has exactly one winner
+        self.assertAlmostEqual(sum(histogram.mean_win_totals.values()), 450)
+
+    def test_win_total_percentiles(self):
+        percentiles = self.simulator.win_total_histogram.percentiles((10, 50, 90))
+        for low, median, high in percentiles.values():
+            self.assertTrue(0 <= low <= median <= high <= 50)
+        self.assertGreater(percentiles['W0'][1], percentiles['W8'][1])
+
+    def test_seed_distribution(self):
+        counts = self.simulator.seed_distribution.counts
+        self.assertEqual(counts.shape, (18, 9))
+        # every seed of both conferences is taken once per trial
+        self.assertTrue((counts.sum(axis=0) == 2 * 2000).all())
+        self.assertTrue((counts.sum(axis=1) == 2000).all())
+
+    def test_simulations_add_up_across_calls(self):
+        self.simulator.simulate_many_seasons(500)
+        self.assertEqual(self.simulator.trials, 2500)
+        self.assertAlmostEqual(sum(self.simulator.get_championship_probabilities().values()), 1)
+
+    def test_probabilities_add_up(self):
+        self.assertAlmostEqual(sum(self.simulator.playoff_probabilities.values()), 16)
+        self.assertAlmostEqual(sum(self.simulator.top_seed_probabilities.values()), 2)
+        self.assertAlmostEqual(sum(self.simulator.get_championship_probabilities().values()), 1)
+
+    def test_better_teams_more_likely_to_finish_first(self):
+        top_seed = self.simulator.top_seed_probabilities
+        self.assertGreater(top_seed['W0'], top_seed['W8'])
+        self.assertGreater(top_seed['E0'], top_seed['E8'])
+
+    def test_seed_reproduces_results(self):
+        teams, games = make_league()
+        for workers in (1, 2):
+            first = elo.Simulator(2016, teams, games, workers=workers, seed=7)
+            second = elo.Simulator(2016, teams, games, workers=workers, seed=7)
+            first.simulate_many_seasons(1000)
+            second.simulate_many_seasons(1000)
+            self.assertTrue((first.win_total_histogram.counts == second.win_total_histogram.counts).all())
+            self.assertEqual(first.get_championship_probabilities(), second.get_championship_probabilities())
+
+    def test_seed_reproduces_results_in_any_team_order(self):
+        teams, games = make_league()
+        first = elo.Simulator(2016, teams, games, seed=7)
+        second = elo.Simulator(2016, list(reversed(teams)), games, seed=7)
+        first.simulate_many_seasons(1000)
+        second.simulate_many_seasons(1000)
+        self.assertEqual(first.symbols, second.symbols)
+        self.assertEqual(first.get_championship_probabilities(), second.get_championship_probabilities())
+        self.assertEqual(first.playoff_probabilities, second.playoff_probabilities)
+
+    def test_tiebreak_codes_sort_like_the_percentages(self):
+        rng = numpy.random.default_rng(0)
+        games = rng.integers(1, 83, (2, 200, 6))
+        percentages = rng.integers(0, 83, games.shape) % (games + 1) / games
+        codes, capacity = elo.get_tiebreak_codes([(percentages[0], 82), (percentages[1], 82)])
+        self.assertLess(capacity, 2 ** 63)
+        for row in range(percentages.shape[1]):
+            keys = list(zip(-percentages[0, row], -percentages[1, row]))
+            for i, j in itertools.combinations(range(6), 2):
+                self.assertEqual(codes[row, i] < codes[row, j], keys[i] < keys[j])
+                self.assertEqual(codes[row, i] == codes[row, j], keys[i] == keys[j])
+
+    def test_standard_errors(self):
+        errors = self.simulator.standard_errors
+        playoff = self.simulator.playoff_probabilities
+        for symbol, p in playoff.items():
+            self.assertAlmostEqual(errors[symbol]['playoff'], (p * (1 - p) / 1999) ** .5)
+        self.assertEqual(self.simulator.max_standard_error,
+            max(max(team_errors.values()) for team_errors in errors.values()))
+
+    def test_simulate_until_precise(self):
+        teams, games = make_league()
+        simulator = elo.Simulator(2016, teams, games, seed=3)
+        simulator.simulate_until_precise(tolerance=.02, max_trials=20000, batch_trials=200)
+        self.assertLessEqual(simulator.max_standard_error, .02)
+        self.assertEqual(simulator.trials % 200, 0)
+        self.assertLess(simulator.trials, 20000)
+
+        # the trial budget wins over the tolerance
+        simulator = elo.Simulator(2016, teams, games, seed=3)
+        simulator.simulate_until_precise(tolerance=0, max_trials=500, batch_trials=200)
+        self.assertEqual(simulator.trials, 500)
+
+    def test_simulate_until_precise_reuses_one_pool(self):
+        teams, games = make_league()
+        serial = elo.Simulator(2016, teams, games, seed=3, workers=2)
+        for _ in range(3):
+            serial.simulate_many_seasons(200)
+
+        simulator = elo.Simulator(2016, teams, games, seed=3, workers=2)
+        with mock.patch.object(simulator, 'create_pool', wraps=simulator.create_pool) as create_pool:
+            simulator.simulate_until_precise(tolerance=0, max_trials=600, batch_trials=200)
+        create_pool.assert_called_once_with()
+        # the same seeds give the same results on one pool or one per batch
+        self.assertEqual(simulator.playoff_probabilities, serial.playoff_probabilities)
+
+
+class TestTeamRatingLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.team = elo.Team('CLE', datetime.date(2015, 10, 26), elo.EASTERN_CONFERENCE)
+        for day, change in ((27, 10), (28, -4), (30, 6)):
+            self.team.update_rating(datetime.date(2015, 10, day), change, change > 0)
+
+    def test_current_rating_and_record(self):
+        self.assertEqual(self.team.current_rating, 1512)
+        self.assertEqual(self.team.current_record, (2, 1))
+
+    def test_change_past_games(self):
+        self.assertEqual(self.team.change_past_games(1), 6)
+        self.assertEqual(self.team.change_past_games(2), 2)
+        self.assertEqual(self.team.change_past_games(15), 12)
+
+    def test_rating_as_of(self):
+        self.assertEqual(self.team.rating_as_of(datetime.date(2015, 10, 1)), 1500)
+        self.assertEqual(self.team.rating_as_of(datetime.date(2015, 10, 28)), 1506)
+        self.assertEqual(self.team.rating_as_of(datetime.date(2015, 10, 29)), 1506)
+        self.assertEqual(self.team.rating_as_of(datetime.date(2015, 11, 1)), 1512)
+
+    def test_rating_as_of_with_game_start_times(self):
+        # seasons start on a date and games are played at a time of day
+        team = elo.Team('CLE', datetime.date(2015, 10, 26), elo.EASTERN_CONFERENCE)
+        for day, change in ((27, 10), (28, -4), (30, 6)):
+            team.update_rating(datetime.datetime(2015, 10, day, 19, 30), change, change > 0)
+        self.assertEqual(team.rating_as_of(datetime.date(2015, 10, 26)), 1500)
+        self.assertEqual(team.rating_as_of(datetime.date(2015, 10, 28)), 1506)
+        self.assertEqual(team.rating_as_of(datetime.datetime(2015, 10, 30, 8)), 1512)
+        self.assertEqual(team.rating_history[-1], (datetime.date(2015, 10, 31), 1512))
+
+    def test_rating_history(self):
+        history = self.team.rating_history
+        self.assertEqual(history[0], (datetime.date(2015, 10, 26), 1500))
+        self.assertEqual(history[3], (datetime.date(2015, 10, 29), 1506))
+        self.assertEqual(history[-1], (datetime.date(2015, 10, 31), 1512))
+
+
+class TestPlayoffProbabilities(unittest.TestCase):
+
+    def test_series_win_probability(self):
+        self.assertAlmostEqual(elo.get_series_win_probability(0.5), 0.5)
+        self.assertAlmostEqual(elo.get_series_win_probability(0.6), 0.710208)
+        self.assertAlmostEqual(elo.get_series_win_probability(0.6, wins_needed=1), 0.6)
+
+    def test_bracket_probabilities_match_enumeration(self):
+        series = numpy.array([[.5, .7, .6, .8], [.3, .5, .4, .9], [.4, .6, .5, .55], [.2, .1, .45, .5]])
+        probabilities = elo.get_bracket_probabilities(numpy.array([[0, 1, 2, 3]]), series)[0]
+
+        self.assertAlmostEqual(probabilities[0, 0], .7)
+        self.assertAlmostEqual(probabilities[0, 1], .7 * (.55 * .6 + .45 * .8))
+        self.assertAlmostEqual(probabilities[3, 1], .45 * (.7 * .2 + .3 * .1))
+        numpy.testing.assert_allclose(probabilities.sum(axis=0), [2, 1])
+
+    def test_round_probabilities_add_up(self):
+        teams, games = make_league()
+        season = elo.SeasonSnapshot.from_games(2016, teams, games).fork()
+        season.simulate_remaining()
+        playoffs = elo.PlayoffSimulator(2016, season.teams, season.current_standings)
+
+        probabilities = numpy.array(list(playoffs.round_probabilities().values()))
+        self.assertEqual(probabilities.shape, (16, 4))
+        numpy.testing.assert_allclose(probabilities.sum(axis=0), [8, 4, 2, 1])
+
+
+class TestStandings(unittest.TestCase):
+
+    def make_standings(self, results):
+        conferences = {symbol: elo.WESTERN_CONFERENCE for symbol in ('GSW', 'LAC', 'PHO', 'DAL', 'SAS')}
+        conferences['BOS'] = elo.EASTERN_CONFERENCE
+        standings = elo.Standings(conferences)
+        for winner, loser in results:
+            standings.record(winner, loser)
+        return standings
+
+    def test_head_to_head_breaks_ties(self):
+        standings = self.make_standings([('LAC', 'GSW'), ('GSW', 'BOS'), ('BOS', 'LAC')])
+        self.assertEqual(standings.seeding[elo.WESTERN_CONFERENCE][:2], ['LAC', 'GSW'])
+
+    def test_division_record_before_conference_record(self):
+        standings = self.make_standings([('GSW', 'LAC'), ('LAC', 'GSW'), ('GSW', 'PHO'), ('DAL', 'GSW'),
+            ('GSW', 'BOS'), ('PHO', 'LAC'), ('LAC', 'DAL'), ('LAC', 'SAS')])
+        self.assertEqual(standings.records['GSW'], standings.records['LAC'])
+        self.assertEqual(standings.seeding[elo.WESTERN_CONFERENCE][:2], ['GSW', 'LAC'])
+
+    def test_seeding_is_cached_until_next_result(self):
+        standings = self.make_standings([('GSW', 'LAC')])
+        seeding = standings.seeding
+        self.assertIs(standings.seeding, seeding)
+        standings.record('LAC', 'DAL')
+        self.assertIsNot(standings.seeding, seeding)
+
+    def test_season_keeps_standings_up_to_date(self):
+        teams, games = make_league()
+        season = elo.SeasonSnapshot.from_games(2016, teams, games).fork()
+        season.simulate_remaining()
+
+        records = collections.defaultdict(lambda: [0, 0])
+        for game in season:
+            records[game.winner][0] += 1
+            records[game.loser][1] += 1
+        for conference in season.current_standings:
+            self.assertEqual(len(conference), 9)
+            for symbol, record, _ in conference:
+                self.assertEqual(list(record), records[symbol])
+            win_percentages = [record[0] / sum(record) for _, record, _ in conference]
+            self.assertEqual(win_percentages, sorted(win_percentages, reverse=True))
+
+
+class TestSeasonSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.teams, self.games = make_league()
+        self.snapshot = elo.SeasonSnapshot.from_games(2016, self.teams, self.games)
+
+    def test_snapshot_leaves_inputs_untouched(self):
+        self.assertTrue(all(team.current_record == (0, 0) for team in self.teams))
+        self.assertTrue(all(team.current_rating == 1500 for team in self.teams))
+
+    def test_snapshot_records(self):
+        played = sum(1 for game in self.games if game.is_complete)
+        self.assertEqual(len(self.snapshot.completed_games), played)
+        self.assertEqual(len(self.snapshot.remaining_games), len(self.games) - played)
+        self.assertEqual(sum(team.wins for team in self.snapshot.teams), played)
+
+    def test_forks_are_isolated(self):
+        first = self.snapshot.fork()
+        first.simulate_remaining()
+        second = self.snapshot.fork()
+
+        self.assertTrue(first.is_season_complete)
+        self.assertFalse(second.is_season_complete)
+        for state in self.snapshot.teams:
+            self.assertEqual(second.teams[state.symbol].current_record, (state.wins, state.losses))
+            self.assertEqual(second.teams[state.symbol].current_rating, state.rating)
+
+
+    def test_daily_snapshots_match_replaying_each_date(self):
+        dates = [datetime.date(2015, 10, 2), datetime.date(2015, 10, 10), datetime.date(2015, 11, 1)]
+        snapshots = dict(elo.iter_daily_snapshots(2016, self.teams, self.games, dates))
+        for date in dates:
+            games = elo.Game.from_list_of_games(self.games)
+            tasks.uncomplete_games(games, date)
+            expected = elo.SeasonSnapshot.from_games(2016, self.teams, games)
+            self.assertEqual(snapshots[date].teams, expected.teams)
+            self.assertEqual(snapshots[date].completed_games, expected.completed_games)
+            self.assertEqual(snapshots[date].remaining_games, expected.remaining_games)
+            self.assertEqual(snapshots[date].standings.records, expected.standings.records)
+
+
+class TestParameterSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.teams, games = make_league(played_through=datetime.datetime(2016, 1, 1))
+        self.games = [game for game in sorted(games, key=lambda g: g.date) if game.is_complete]
+        self.rows = [(i, 2016, g.date, g.home_team, g.away_team, g.home_points, g.away_points)
+            for i, g in enumerate(self.games)]
+
+    def test_default_parameters_match_season(self):
+        sweep = elo.ParameterSweep({})
+        sweep.add(self.rows)
+
+        season = elo.Season(2016, self.teams, elo.Game.from_list_of_games(self.games))
+        log_loss = 0
+        for game in season:
+            p = elo.get_expected_outcome(season.teams[game.home_team].current_rating,
+                season.teams[game.away_team].current_rating)
+            log_loss -= math.log(p if game.home_points > game.away_points else 1 - p)
+            season.update_ratings(game)
+
+        for symbol, team in season.teams.items():
+            self.assertAlmostEqual(sweep.ratings[sweep.index[symbol], 0], team.current_rating)
+        (parameters, mean_log_loss, _), = sweep.scores()
+        self.assertEqual(parameters, elo.RatingParameters())
+        self.assertAlmostEqual(mean_log_loss, log_loss / len(self.games))
+
+    def test_grid_is_scored_per_combination(self):
+        sweep = elo.ParameterSweep(dict(k_factor=[0, 20, 40], mov_exponent=[.8, 1]))
+        sweep.add(self.rows)
+        self.assertEqual(len(sweep.parameters), 6)
+        scores = sweep.scores()
+        self.assertEqual([s[1] for s in scores], sorted(s[1] for s in scores))
+        # without updates every game is a coin flip
+        for parameters, log_loss, brier_score in scores:
+            if parameters.k_factor == 0:
+                self.assertAlmostEqual(log_loss, math.log(2))
+                self.assertAlmostEqual(brier_score, .25)
+        # the better team always wins so the biggest updates predict best
+        self.assertEqual(sweep.best_parameters.k_factor, 40)
+
+
+class DatabaseTestCase(TestCase):
+
+    def create_app(self):
+        return create_app('testing')
+
+    def setUp(self):
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+
+    @contextlib.contextmanager
+    def count_queries(self):
+        """Collects the statements executed inside the block"""
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+        sqlalchemy.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            sqlalchemy.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    def insert_league(self, year=2016, **kwargs):
+        """Inserts the games of `make_league` as the season `year`, moved
+        forward a year for every year after 2016"""
+        teams, games = make_league(**kwargs)
+        season = models.Season(year=year)
+        db.session.add(season)
+        symbols = {team.symbol for team in models.Team.query.all()}
+        db.session.add_all([models.Team(team_name=team.symbol, symbol=team.symbol) for team in teams
+            if team.symbol not in symbols])
+        db.session.commit()
+
+        team_ids = {team.symbol: team.id for team in models.Team.query.all()}
+        shift = datetime.timedelta(days=365 * (year - 2016))
+        db.session.add_all([models.Game(date=g.date + shift, home_id=team_ids[g.home_team],
+            away_id=team_ids[g.away_team], home_points=g.home_points, away_points=g.away_points, season=season.id)
+            for g in games])
+        db.session.commit()
+        return season
+
+
+class TestInsertSchedule(DatabaseTestCase):
+
+    def schedule(self, first_score=(100, 90), second_score=(None, None)):
+        first = datetime.datetime(2015, 10, 27, 20, tzinfo=pytz.utc)
+        second = datetime.datetime(2015, 11, 20, 20, tzinfo=pytz.utc)
+        return {
+            'CLE': [scrape.Game(first, True, 'Golden State Warriors', first_score[0], first_score[1], 'GSW'),
+                scrape.Game(second, False, 'Golden State Warriors', second_score[1], second_score[0], 'GSW')],
+            'GSW': [scrape.Game(first, False, 'Cleveland Cavaliers', first_score[1], first_score[0], 'CLE'),
+                scrape.Game(second, True, 'Cleveland Cavaliers', second_score[0], second_score[1], 'CLE')],
+        }
+
+    def test_records_inserted_and_changed_games(self):
+        changes = models.Game.insert_schedule_of_games(2016, self.schedule())
+        self.assertEqual((len(changes.inserted), len(changes.changed)), (2, 0))
+        self.assertEqual(changes.earliest_date, datetime.date(2015, 10, 27))
+        self.assertEqual(changes.stale_probabilities_since, datetime.date(2015, 10, 27))
+        self.assertEqual(models.Game.query.count(), 2)
+
+        changes = models.Game.insert_schedule_of_games(2016, self.schedule())
+        self.assertEqual((changes.inserted, changes.changed), ([], []))
+        self.assertIsNone(changes.earliest_date)
+        self.assertIsNone(changes.stale_probabilities_since)
+
+        changes = models.Game.insert_schedule_of_games(2016, self.schedule(second_score=(95, 99)))
+        self.assertEqual(len(changes.changed), 1)
+        self.assertEqual(changes.stale_probabilities_since, datetime.date(2015, 11, 21))
+
+        # a corrected score is picked up as well
+        changes = models.Game.insert_schedule_of_games(2016, self.schedule((100, 93), (95, 99)))
+        self.assertEqual(len(changes.changed), 1)
+        self.assertEqual((changes.changed[0].home_points, changes.changed[0].away_points), (100, 93))
+        self.assertEqual(changes.earliest_date, datetime.date(2015, 10, 27))
+
+    def test_late_game_only_makes_later_probabilities_stale(self):
+        models.Game.insert_schedule_of_games(2016, self.schedule())
+        schedule = self.schedule()
+        late = datetime.datetime(2016, 3, 1, 20, tzinfo=pytz.utc)
+        schedule['CLE'].append(scrape.Game(late, True, 'Golden State Warriors', None, None, 'GSW'))
+        schedule['GSW'].append(scrape.Game(late, False, 'Cleveland Cavaliers', None, None, 'CLE'))
+        changes = models.Game.insert_schedule_of_games(2016, schedule)
+        self.assertEqual(len(changes.inserted), 1)
+        self.assertEqual(changes.stale_probabilities_since, datetime.date(2016, 3, 1))
+
+    def test_season_is_ingested_in_a_handful_of_statements(self):
+        _, games = make_league()
+        schedules = collections.defaultdict(list)
+        for g in games:
+            date = pytz.timezone('US/Eastern').localize(g.date)
+            schedules[g.home_team].append(scrape.Game(date, True, g.away_team, g.home_points, g.away_points, g.away_team))
+            schedules[g.away_team].append(scrape.Game(date, False, g.home_team, g.away_points, g.home_points, g.home_team))
+
+        with self.count_queries() as statements:
+            changes = models.Game.insert_schedule_of_games(2016, schedules)
+        self.assertEqual(len(changes.inserted), 450)
+        self.assertEqual(models.Game.query.count(), 450)
+        self.assertLessEqual(len(statements), 25)
+
+        schedules['W0'][-1] = schedules['W0'][-1]._replace(points=110, opponent_points=100)
+        with self.count_queries() as statements:
+            changes = models.Game.insert_schedule_of_games(2016, schedules)
+        self.assertEqual((len(changes.inserted), len(changes.changed)), (0, 1))
+        self.assertLessEqual(len(statements), 5)
+
+    def test_insert_league_schedule(self):
+        first = datetime.datetime(2015, 10, 27, 20, tzinfo=pytz.timezone('US/Eastern'))
+        games = [scrape.LeagueGame(first, 'CHI', 'CLE', 97, 95, 'Chicago Bulls', 'Cleveland Cavaliers'),
+            scrape.LeagueGame(first + datetime.timedelta(days=1), 'CLE', 'MEM', None, None, 'Cleveland Cavaliers',
+                'Memphis Grizzlies')]
+        changes = models.Game.insert_league_schedule(2016, games)
+
+        self.assertEqual(len(changes.inserted), 2)
+        self.assertEqual(models.Team.query.filter_by(symbol='MEM').one().team_name, 'Memphis Grizzlies')
+        self.assertEqual(db.session.query(models.Game.home_points, models.Game.away_points).order_by(
+            models.Game.date).all(), [(97, 95), (None, None)])
+
+        games[1] = games[1]._replace(home_points=106, away_points=76)
+        changes = models.Game.insert_league_schedule(2016, games)
+        self.assertEqual((len(changes.inserted), len(changes.changed)), (0, 1))
+
+
+class TestIngestArchive(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.directory, 'pages', 'teams', 'CLE'))
+        shutil.copy(os.path.join(basedir, 'cle_2016_schedule.html'),
+            os.path.join(self.directory, 'pages', 'teams', 'CLE', '2016_games.html'))
+        with open(os.path.join(self.directory, 'pages', 'README.txt'), 'w') as f:
+            f.write('not a schedule')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def test_parse_schedule_name(self):
+        self.assertEqual(ingest.parse_schedule_name('teams/CLE/2016_games.html'), ('CLE', 2016))
+        self.assertEqual(ingest.parse_schedule_name('archive/cle_2016_schedule.html'), ('CLE', 2016))
+        self.assertIsNone(ingest.parse_schedule_name('teams/CLE/index.html'))
+
+    def test_ingest_directory(self):
+        changes = ingest.ingest_archive(os.path.join(self.directory, 'pages'), processes=2)
+
+        self.assertEqual(list(changes), [2016])
+        self.assertEqual(len(changes[2016].inserted), 82)
+        self.assertEqual(models.Game.query.count(), 82)
+        self.assertEqual(models.Team.query.filter_by(symbol='GSW').one().team_name, 'Golden State Warriors')
+
+        # ingesting again finds every game in place
+        changes = ingest.ingest_archive(os.path.join(self.directory, 'pages'), processes=2)
+        self.assertEqual((changes[2016].inserted, changes[2016].changed), ([], []))
+
+    def test_ingest_tarball(self):
+        path = os.path.join(self.directory, 'pages.tar.gz')
+        with tarfile.open(path, 'w:gz') as archive:
+            archive.add(os.path.join(self.directory, 'pages'), arcname='pages')
+        changes = ingest.ingest_archive(path, processes=2)
+
+        self.assertEqual(len(changes[2016].inserted), 82)
+        self.assertEqual(models.Game.query.count(), 82)
+
+
+    def test_reading_waits_for_inserts(self):
+        with open(os.path.join(basedir, 'cle_2016_schedule.html'), encoding='utf-8') as f:
+            raw_html = f.read()
+        read = []
+
+        def iter_archive(path):
+            for year in (2016, 2017):
+                for i in range(6):
+                    read.append(year)
+                    yield 'T%s%s/%s_games.html' % ('ABCDEF'[i], 'ABCDEF'[i], year), raw_html
+
+        inserted_after = []
+
+        def insert_schedule_of_games(season_year, schedules):
+            inserted_after.append(len(read))
+            return models.ScheduleChanges([], [])
+
+        with mock.patch.object(ingest, 'iter_archive', iter_archive), \
+                mock.patch.object(models.Game, 'insert_schedule_of_games', side_effect=insert_schedule_of_games):
+            changes = ingest.ingest_archive('pages', processes=2, max_pending=2)
+        self.assertEqual(sorted(changes), [2016, 2017])
+        # 2016 goes in once the first page of 2017 is parsed, at most two pages ahead
+        self.assertLessEqual(inserted_after[0], 8)
+
+class TestLoadGames(DatabaseTestCase):
+
+    def test_games_load_with_one_query(self):
+        season = self.insert_league(2016)
+        self.insert_league(2017)
+        _, expected = make_league()
+
+        with self.count_queries() as statements:
+            season_id, games, teams = tasks.load_season(2016)
+        # one to find the season, one for its games and one for the season
+        # before it to carry ratings over from, never one per game
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(season_id, season.id)
+        self.assertEqual(sorted((g.date, g.home_team, g.away_team, g.home_points) for g in games),
+            sorted((g.date, g.home_team, g.away_team, g.home_points) for g in expected))
+
+    def test_streaming_every_season(self):
+        self.insert_league(2016)
+        self.insert_league(2017)
+        with self.count_queries() as statements:
+            rows = list(models.load_games(chunk_size=100))
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(len(rows), 2 * 450)
+        self.assertEqual([row.date for row in rows], sorted(row.date for row in rows))
+        self.assertEqual(rows[0][1:3], (rows[0].home_team, rows[0].away_team))
+
+    def test_pending_games(self):
+        self.assertIsNone(tasks.get_pending_games(2016))
+        self.insert_league(2016)
+
+        pending = tasks.get_pending_games(2016, now=datetime.datetime(2015, 10, 22, 12))
+        # the games of the 20th, 21st and 22nd are over but have no score
+        self.assertEqual(len(pending), 27)
+        self.assertEqual({dt.date() for dt, _, _ in pending},
+            {datetime.date(2015, 10, day) for day in (20, 21, 22)})
+        self.assertEqual(tasks.get_pending_games(2016, now=datetime.datetime(2015, 10, 19)), [])
+        # an aware time is compared in Eastern time, 2am UTC is still the 22nd there
+        now = pytz.utc.localize(datetime.datetime(2015, 10, 23, 2))
+        self.assertEqual(len(tasks.get_pending_games(2016, now=now)), 27)
+
+
+class TestSeasonCache(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.app.config['SEASON_CACHE_DIR'] = self.directory
+        self.insert_league(2016)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    def as_tuples(self, games):
+        return sorted((g.game_id, g.date, g.home_team, g.away_team, g.home_points, g.away_points) for g in games)
+
+    def test_season_is_loaded_from_the_cache(self):
+        season_id, games = tasks.load_season_games(2016)
+        tasks.write_season_cache(2016)
+
+        with mock.patch.object(tasks, 'load_season_games') as load_season_games:
+            cached_season_id, cached_games, teams = tasks.load_season(2016)
+        self.assertFalse(load_season_games.called)
+        self.assertEqual(cached_season_id, season_id)
+        self.assertEqual(self.as_tuples(cached_games), self.as_tuples(games))
+        self.assertEqual(len(teams), 18)
+
+    def test_new_version_replaces_the_old_one(self):
+        tasks.write_season_cache(2016)
+        first = cache.load_season(self.directory, 2016)
+        game = models.Game.query.filter(models.Game.home_points.is_(None)).first()
+        game.home_points, game.away_points = 101, 99
+        db.session.commit()
+        tasks.write_season_cache(2016)
+
+        second = cache.load_season(self.directory, 2016)
+        self.assertNotEqual(first.content_hash, second.content_hash)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+            ['season-2016-%s.npy' % second.content_hash, 'season-2016.json'])
+        # the older version stays readable through its existing map
+        self.assertEqual(len(first.to_games()), len(second.to_games()))
+        played = [g for g in second.to_games() if g.game_id == game.id][0]
+        self.assertEqual((played.home_points, played.away_points), (101, 99))
+
+
+    def test_stale_cache_is_rebuilt(self):
+        tasks.write_season_cache(2016)
+        first = cache.load_season(self.directory, 2016)
+        # changed behind the cache's back, like a run without a cache directory
+        game = models.Game.query.filter(models.Game.home_points.isnot(None)).first()
+        game.home_points += 7
+        db.session.commit()
+
+        _, games, _ = tasks.load_season(2016)
+        self.assertEqual([g.home_points for g in games if g.game_id == game.id], [game.home_points])
+        second = cache.load_season(self.directory, 2016)
+        self.assertNotEqual(first.content_hash, second.content_hash)
+        self.assertEqual(second.version, tasks.get_season_version(game.season))
+
+class TestBulkInsert(DatabaseTestCase):
+
+    def test_copy_csv(self):
+        rows = [dict(season_id=1, date=datetime.date(2016, 10, 25), status='', trials=None, duration=1.5,
+            updated_at=datetime.datetime(2016, 10, 25, 19, 30, tzinfo=pytz.utc), won=True),
+            dict(season_id=2, date=datetime.date(2016, 10, 26), status='a, "b"', trials=1000, duration=None,
+            updated_at=datetime.datetime(2016, 10, 26, 8), won=False)]
+        f = io.StringIO()
+        models.write_copy_csv(rows, list(rows[0]), f)
+        self.assertEqual(f.getvalue().splitlines(), [
+            '1,2016-10-25,,\\N,1.5,2016-10-25T19:30:00+00:00,true',
+            '2,2016-10-26,"a, ""b""",1000,\\N,2016-10-26T08:00:00,false'])
+
+    def test_nulls_dates_and_times_round_trip(self):
+        season = models.Season(year=2016)
+        db.session.add(season)
+        db.session.commit()
+        updated_at = datetime.datetime(2016, 10, 25, 19, 30)
+        models.bulk_insert(models.ProbabilityJob, [
+            dict(season_id=season.id, date=datetime.date(2016, 10, 25), status=models.ProbabilityJob.PENDING,
+                trials=None, duration=None, updated_at=None),
+            dict(season_id=season.id, date=datetime.date(2016, 10, 26), status=models.ProbabilityJob.COMPLETE,
+                trials=1000, duration=.25, updated_at=updated_at)])
+        db.session.commit()
+
+        jobs = models.ProbabilityJob.query.order_by(models.ProbabilityJob.date).all()
+        self.assertEqual([(job.date, job.status, job.trials, job.duration, job.updated_at) for job in jobs], [
+            (datetime.date(2016, 10, 25), models.ProbabilityJob.PENDING, None, None, None),
+            (datetime.date(2016, 10, 26), models.ProbabilityJob.COMPLETE, 1000, .25, updated_at)])
+
+
+@unittest.skipUnless(os.environ.get('TEST_DATABASE_URL', '').startswith('postgresql'),
+    "set TEST_DATABASE_URL to a scratch PostgreSQL database to test COPY")
+class TestPostgresBulkInsert(TestBulkInsert):
+
+    """The tests of `TestBulkInsert` against PostgreSQL, where `bulk_insert`
+    uses COPY. Its tables are dropped after every test."""
+
+    def create_app(self):
+        class PostgresTestingConfig(TestingConfig):
+            SQLALCHEMY_DATABASE_URI = os.environ['TEST_DATABASE_URL']
+        config['postgres-testing'] = PostgresTestingConfig()
+        return create_app('postgres-testing')
+
+
+class TestGenerateProbabilities(DatabaseTestCase):
+
+    def test_generate_season_probabilities(self):
+        season = self.insert_league()
+        dates = [datetime.date(2015, 10, 5), datetime.date(2015, 10, 15)]
+        tasks.generate_season_probabilities(2016, dates, trials=200, seed=1)
+        # regenerating a date replaces its rows
+        tasks.generate_daily_probabilities(dates[0], trials=200, seed=1, tolerance=.05)
+
+        rows = models.SimulatedProbabilities.query.filter_by(season_id=season.id).all()
+        self.assertEqual(len(rows), 2 * 18)
+        for date in dates:
+            self.assertAlmostEqual(sum(row.playoff for row in rows if row.date == date), 16)
+            self.assertAlmostEqual(sum(row.champion for row in rows if row.date == date), 1)
+        for row in rows:
+            self.assertEqual(row.trials % 200, 0)
+            self.assertGreater(row.standard_error, 0)
+        self.assertTrue(all(row.standard_error <= .05 for row in rows if row.date == dates[0]))
+
+    def test_backfill_matches_generating_each_season(self):
+        self.insert_league(2016)
+        self.insert_league(2017)
+        season_dates = {2016: [datetime.date(2015, 10, 5), datetime.date(2015, 10, 15)],
+            2017: [datetime.date(2016, 10, 4), datetime.date(2016, 10, 10), datetime.date(2016, 10, 20)]}
+
+        def saved_probabilities():
+            return {(row.season_id, row.team_id, row.date): (row.playoff, row.top_seed, row.champion)
+                for row in models.SimulatedProbabilities.query.all()}
+
+        for year, dates in season_dates.items():
+            tasks.generate_season_probabilities(year, dates, trials=200, seed=5)
+        expected = saved_probabilities()
+        models.SimulatedProbabilities.query.delete()
+        db.session.commit()
+
+        backfill.backfill_probabilities(season_dates, trials=200, seed=5, processes=2, max_pending=2, write_batch=2)
+        self.assertEqual(len(expected), 5 * 18)
+        self.assertEqual(saved_probabilities(), expected)
+
+
+class TestProbabilityJobs(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.season = self.insert_league(2016)
+        self.other_season = self.insert_league(2017)
+        self.dates = [datetime.date(2015, 10, 5), datetime.date(2015, 10, 6), datetime.date(2015, 10, 7)]
+
+    def test_completed_dates_are_checkpointed_per_season(self):
+        tasks.generate_season_probabilities(2016, self.dates[:2], trials=100, seed=1)
+        tasks.generate_season_probabilities(2017, [datetime.date(2015, 10, 7) + datetime.timedelta(days=365)],
+            trials=100, seed=1)
+
+        self.assertEqual(tasks.get_completed_dates(self.season.id), set(self.dates[:2]))
+        job = models.ProbabilityJob.query.filter_by(season_id=self.season.id, date=self.dates[0]).one()
+        self.assertEqual((job.status, job.trials), (models.ProbabilityJob.COMPLETE, 100))
+        self.assertGreater(job.duration, 0)
+
+        job_status = tasks.get_job_status(self.season.id, self.dates)
+        self.assertEqual((job_status.total, job_status.complete, job_status.trials), (3, 2, 200))
+        self.assertGreater(job_status.rate, 0)
+        self.assertIsNotNone(job_status.eta)
+
+    def test_reset_dates_are_generated_again(self):
+        tasks.generate_season_probabilities(2016, self.dates, trials=100, seed=1)
+        tasks.reset_jobs(self.season.id, self.dates[1:])
+        # the old probabilities stay until they are replaced
+        self.assertEqual(models.SimulatedProbabilities.query.filter_by(date=self.dates[2]).count(), 18)
+        self.assertEqual(tasks.get_completed_dates(self.season.id), {self.dates[0]})
+
+        tasks.generate_season_probabilities(2016, self.dates[1:], trials=100, seed=1)
+        self.assertEqual(tasks.get_completed_dates(self.season.id), set(self.dates))
+
+    def test_interrupted_run_keeps_written_dates(self):
+        simulate = tasks.simulate_probabilities
+
+        def simulate_until_third_date(snapshot, *args, **kwargs):
+            if simulate_until_third_date.calls == 2:
+                raise KeyboardInterrupt
+            simulate_until_third_date.calls += 1
+            return simulate(snapshot, *args, **kwargs)
+        simulate_until_third_date.calls = 0
+
+        with mock.patch('nbaelo.tasks.simulate_probabilities', side_effect=simulate_until_third_date):
+            with self.assertRaises(KeyboardInterrupt):
+                tasks.generate_season_probabilities(2016, self.dates, trials=100, seed=1, write_batch=1)
+        self.assertEqual(tasks.get_completed_dates(self.season.id), set(self.dates[:2]))
+
+    def test_dates_generated_before_jobs_count_as_complete(self):
+        tasks.generate_season_probabilities(2016, self.dates, trials=100, seed=1)
+        models.ProbabilityJob.query.delete()
+        db.session.commit()
+        self.assertEqual(tasks.get_completed_dates(self.season.id), set(self.dates))
+        self.assertEqual(tasks.get_completed_dates(self.other_season.id), set())
+
+        # resetting some dates leaves the others without jobs complete
+        tasks.reset_jobs(self.season.id, self.dates[2:])
+        self.assertEqual(tasks.get_completed_dates(self.season.id), set(self.dates[:2]))
+
+
+class TestEloHistory(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.season = self.insert_league()
+
+    def replayed_ratings(self):
+        _, games, teams = tasks.load_season(2016)
+        season = elo.Season(2016, teams, games)
+        season.play_through_season()
+        return {symbol: team.current_rating for symbol, team in season.teams.items()}
+
+    def stored_ratings(self):
+        symbols = {team.id: team.symbol for team in models.Team.query.all()}
+        ratings = {}
+        for row in models.EloHistory.query.order_by(models.EloHistory.date, models.EloHistory.id):
+            ratings[symbols[row.team_id]] = row.rating
+        return ratings
+
+    def assert_history_matches_replay(self):
+        replayed = self.replayed_ratings()
+        for symbol, rating in self.stored_ratings().items():
+            self.assertAlmostEqual(rating, replayed[symbol])
+
+    def test_update_only_rates_new_games(self):
+        completed = models.Game.query.filter(models.Game.home_points.isnot(None)).count()
+        self.assertEqual(tasks.update_elo_history(2016), completed)
+        self.assertEqual(models.EloHistory.query.count(), 2 * completed)
+        self.assert_history_matches_replay()
+        self.assertEqual(tasks.update_elo_history(2016), 0)
+
+        game = models.Game.query.filter(models.Game.home_points.is_(None)).order_by(models.Game.date).first()
+        game.home_points, game.away_points = 90, 100
+        db.session.commit()
+        self.assertEqual(tasks.update_elo_history(2016), 1)
+        self.assert_history_matches_replay()
+
+    def test_rebuild_after_earlier_score_changes(self):
+        tasks.update_elo_history(2016)
+        game = models.Game.query.filter(models.Game.home_points.isnot(None)).order_by(models.Game.date).first()
+        game.home_points = game.away_points + 30
+        db.session.commit()
+
+        rebuilt = models.EloHistory.query.filter(models.EloHistory.date >= game.date.date()).count() // 2
+        self.assertEqual(tasks.update_elo_history(2016, since=game.date.date()), rebuilt)
+        self.assert_history_matches_replay()
+
+    def test_rebuild_when_an_earlier_result_is_added(self):
+        tasks.update_elo_history(2016)
+        game = models.Game.query.filter(models.Game.home_points.isnot(None)).order_by(models.Game.date).first()
+        game.home_points = game.away_points = None
+        db.session.commit()
+        tasks.update_elo_history(2016)
+        self.assert_history_matches_replay()
+
+        game.home_points, game.away_points = 100, 90
+        db.session.commit()
+        self.assertEqual(tasks.update_elo_history(2016),
+            models.Game.query.filter(models.Game.home_points.isnot(None)).count())
+        self.assert_history_matches_replay()
+
+
+class TestUpgradeSchema(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # the two tables as created before their columns were added
+        models.EloHistory.__table__.drop(db.engine)
+        models.SimulatedProbabilities.__table__.drop(db.engine)
+        db.session.execute(sqlalchemy.text('CREATE TABLE elohistory (id INTEGER PRIMARY KEY, season_id INTEGER, '
+            'team_id INTEGER, date DATE, rating_change FLOAT)'))
+        db.session.execute(sqlalchemy.text('CREATE TABLE simulatedprobabilities (season_id INTEGER, team_id INTEGER, '
+            'date DATE, playoff FLOAT, top_seed FLOAT, champion FLOAT, PRIMARY KEY (season_id, team_id, date))'))
+        db.session.execute(sqlalchemy.text("INSERT INTO elohistory (season_id, team_id, date, rating_change) "
+            "VALUES (1, 1, '2016-11-01', 5.0)"))
+        db.session.commit()
+
+    def columns(self, model):
+        return {column['name'] for column in sqlalchemy.inspect(db.engine).get_columns(model.__tablename__)}
+
+    def test_adds_missing_columns(self):
+        self.assertEqual(len(models.upgrade_schema()), 6)
+        self.assertTrue({'game_id', 'rating', 'won'} <= self.columns(models.EloHistory))
+        self.assertTrue({'trials', 'standard_error'} <= self.columns(models.SimulatedProbabilities))
+        # rows without a game are dropped for `update_elo_history` to rebuild
+        self.assertEqual(models.EloHistory.query.count(), 0)
+        self.assertEqual(models.upgrade_schema(), [])
+
+
+class TestRateAllSeasons(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.insert_league(2016)
+        self.insert_league(2017)
+
+    def history(self):
+        return db.session.query(models.EloHistory.game_id, models.EloHistory.team_id, models.EloHistory.rating)\
+            .order_by(models.EloHistory.date, models.EloHistory.game_id, models.EloHistory.team_id).all()
+
+    @mock.patch.object(Config, 'ELO_CARRYOVER', 0.)
+    def test_without_carryover_matches_each_season(self):
+        completed = models.Game.query.filter(models.Game.home_points.isnot(None)).count()
+        self.assertEqual(tasks.rate_all_seasons(chunk_size=50), completed)
+        all_seasons = self.history()
+
+        tasks.update_elo_history(2016, since=datetime.date(2015, 1, 1))
+        tasks.update_elo_history(2017, since=datetime.date(2016, 1, 1))
+        for (game_id, team_id, rating), expected in zip(all_seasons, self.history()):
+            self.assertEqual((game_id, team_id), expected[:2])
+            self.assertAlmostEqual(rating, expected[2])
+
+    def test_calibrate_streams_the_chosen_seasons(self):
+        season_id = models.Season.query.filter_by(year=2016).first().id
+        completed = models.Game.query.filter(models.Game.season == season_id,
+            models.Game.home_points.isnot(None)).count()
+        with self.count_queries() as statements:
+            sweep = tasks.calibrate(dict(k_factor=[20, 40]), [2016], chunk_size=5)
+        self.assertEqual(sweep.games, completed)
+        # one for the season ids and one streaming the games
+        self.assertEqual(len(statements), 2)
+
+    @mock.patch.object(Config, 'ELO_CARRYOVER', .5)
+    def test_carryover(self):
+        tasks.rate_all_seasons(chunk_size=50)
+        season_ids = {season.year: season.id for season in models.Season.query.all()}
+        final_ratings, start_ratings = {}, {}
+        for season_id, team_id, rating, rating_change in db.session.query(models.EloHistory.season_id,
+                models.EloHistory.team_id, models.EloHistory.rating, models.EloHistory.rating_change)\
+                .order_by(models.EloHistory.date, models.EloHistory.id):
+            if season_id == season_ids[2016]:
+                final_ratings[team_id] = rating
+            else:
+                start_ratings.setdefault(team_id, rating - rating_change)
+        for team_id, rating in final_ratings.items():
+            self.assertAlmostEqual(start_ratings[team_id], 1500 + .5 * (rating - 1500))
+
+        # rebuilding a single season carries the ratings over the same way
+        all_seasons = self.history()
+        tasks.update_elo_history(2017, since=datetime.date(2016, 1, 1))
+        for (_, _, rating), (_, _, expected) in zip(all_seasons, self.history()):
+            self.assertAlmostEqual(rating, expected)
+
+
+    @mock.patch.object(Config, 'ELO_CARRYOVER', .5)
+    def test_snapshots_start_from_carried_over_ratings(self):
+        tasks.rate_all_seasons(chunk_size=50)
+        season_id = models.Season.query.filter_by(year=2017).first().id
+        start_ratings = {}
+        for symbol, rating, rating_change in db.session.query(models.Team.symbol, models.EloHistory.rating,
+                models.EloHistory.rating_change).join(models.EloHistory, models.EloHistory.team_id == models.Team.id)\
+                .filter(models.EloHistory.season_id == season_id).order_by(models.EloHistory.date, models.EloHistory.id):
+            start_ratings.setdefault(symbol, rating - rating_change)
+        self.assertTrue(any(abs(rating - 1500) > 1 for rating in start_ratings.values()))
+
+        _, gs, teams = tasks.load_season(2017)
+        first_day = min(g.date for g in gs).date()
+        (_, snapshot), = elo.iter_daily_snapshots(2017, teams, gs, [first_day])
+        for team in snapshot.teams:
+            self.assertAlmostEqual(team.rating, start_ratings[team.symbol])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file